@@ -0,0 +1,77 @@
+import os
+import sys
+import csv
+import json
+import time
+import asyncio
+import argparse
+from .score_engine import score_engine
+
+# 사용법: python -m app.batch_recsys profiles.jsonl --top-n 10 --output recommendations.ndjson
+# 입력은 UserVector 필드를 가진 JSON Lines 또는 CSV 파일
+
+# /recsys/batch 에서 요청할 수 있는 프로필당 추천 수 상한
+BATCH_TOP_N_MAX = int(os.getenv("BATCH_TOP_N_MAX", "100"))
+
+
+def iter_batch_recommendations(user_vectors, top_n=10, stats=None, snapshot=None):
+    """프로필마다 {"reviewer_id", "recommendations"} 를 NDJSON 한 줄씩 생성한다.
+
+    stats 딕셔너리가 주어지면 끝난 뒤 처리량(profiles_per_second)을 채운다.
+    snapshot 을 주지 않으면 score_engine 의 현재 스냅샷을 사용하며, 미리 로드되어 있어야 한다.
+    """
+    snapshot = snapshot or score_engine.snapshot
+    start = time.perf_counter()
+    count = 0
+    for user_vector, recommendations in zip(
+        user_vectors, snapshot.top_products_batch(user_vectors, top_n)
+    ):
+        count += 1
+        yield json.dumps(
+            {"reviewer_id": user_vector.get("reviewer_id"), "recommendations": recommendations},
+            ensure_ascii=False,
+        ) + "\n"
+    elapsed = time.perf_counter() - start
+    if stats is not None:
+        stats.update(
+            profiles=count,
+            seconds=round(elapsed, 3),
+            profiles_per_second=round(count / elapsed, 1) if elapsed > 0 else None,
+        )
+
+
+def read_user_vectors(path):
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            return list(csv.DictReader(f))
+        return [json.loads(line) for line in f if line.strip()]
+
+
+async def _run(args):
+    from .database import SessionLocal, engine
+    from .recsys import user_vector_params
+
+    user_vectors = [
+        user_vector_params(user_vector) for user_vector in read_user_vectors(args.input)
+    ]
+    async with SessionLocal() as db:
+        await score_engine.load(db)
+    await engine.dispose()
+
+    stats = {}
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        for line in iter_batch_recommendations(user_vectors, args.top_n, stats):
+            output.write(line)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    print(json.dumps(stats), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input")
+    parser.add_argument("--top-n", type=int, default=10)
+    parser.add_argument("--output")
+    asyncio.run(_run(parser.parse_args()))
@@ -0,0 +1,228 @@
+import os
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+from sqlalchemy import text
+from .database import engine
+from .embedding import embedding_service
+
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+# 1 이면 query_embedding_cache 테이블을 2차 캐시로 사용 (재시작/워커 간 공유)
+QUERY_EMBEDDING_CACHE_PERSIST = os.getenv("QUERY_EMBEDDING_CACHE_PERSIST", "0") == "1"
+QUERY_EMBEDDING_CACHE_PERSIST_SIZE = int(
+    os.getenv("QUERY_EMBEDDING_CACHE_PERSIST_SIZE", "100000")
+)
+# 추천 결과 캐시 (0 이면 비활성화)
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "1024"))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "300"))
+# data_version 시퀀스를 다시 확인하는 주기(초). 다른 워커의 쓰기는 이 시간만큼 늦게 반영된다.
+DATA_VERSION_POLL_SECONDS = float(os.getenv("DATA_VERSION_POLL_SECONDS", "1"))
+
+
+class LRUCache:
+    """크기 제한이 있는 LRU 캐시. ttl(초)이 주어지면 오래된 항목은 miss 로 처리한다.
+
+    hit/miss 횟수를 함께 기록한다.
+    """
+
+    def __init__(self, maxsize: int, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                value, expires_at = self._data[key]
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def normalize_query(query: str) -> str:
+    # 유니코드 정규화 + 공백 정리. 이 문자열을 그대로 임베딩하므로 대소문자는 바꾸지 않는다
+    # (모델이 대소문자를 구분할 수 있어 소문자로 바꾸면 임베딩과 순위가 달라진다)
+    return " ".join(unicodedata.normalize("NFC", query).split())
+
+
+class QueryEmbeddingCache:
+    """검색어 임베딩 캐시. 메모리 LRU 뒤에 선택적으로 Postgres 테이블을 둔다."""
+
+    def __init__(
+        self,
+        maxsize: int = QUERY_EMBEDDING_CACHE_SIZE,
+        persist: bool = QUERY_EMBEDDING_CACHE_PERSIST,
+    ):
+        self.memory = LRUCache(maxsize)
+        self.persist = persist
+        self.persistent_hits = 0
+
+    async def get(self, query: str) -> np.ndarray:
+        key = normalize_query(query)
+        embedding = self.memory.get(key)
+        if embedding is not None:
+            return embedding
+
+        if self.persist:
+            embedding = await self._load(key)
+            if embedding is not None:
+                self.persistent_hits += 1
+                self.memory.put(key, embedding)
+                return embedding
+
+        embedding = await embedding_service.encode(key)
+        self.memory.put(key, embedding)
+        if self.persist:
+            await self._store(key, embedding)
+        return embedding
+
+    async def _load(self, key: str):
+        async with engine.begin() as conn:
+            result = await conn.execute(
+                text(
+                    """
+                    UPDATE query_embedding_cache SET last_used_at = now()
+                    WHERE query_text = :query_text
+                    RETURNING embedding
+                    """
+                ),
+                {"query_text": key},
+            )
+            return result.scalar()
+
+    async def _store(self, key: str, embedding: np.ndarray):
+        async with engine.begin() as conn:
+            await conn.execute(
+                text(
+                    """
+                    INSERT INTO query_embedding_cache (query_text, embedding, last_used_at)
+                    VALUES (:query_text, :embedding, now())
+                    ON CONFLICT (query_text) DO NOTHING
+                    """
+                ),
+                {"query_text": key, "embedding": embedding},
+            )
+
+    async def prune(self, keep: int = QUERY_EMBEDDING_CACHE_PERSIST_SIZE):
+        # 테이블에는 최근에 사용된 keep 개만 남긴다
+        if not self.persist:
+            return
+        async with engine.begin() as conn:
+            await conn.execute(
+                text(
+                    """
+                    DELETE FROM query_embedding_cache
+                    WHERE query_text NOT IN (
+                        SELECT query_text FROM query_embedding_cache
+                        ORDER BY last_used_at DESC LIMIT :keep
+                    )
+                    """
+                ),
+                {"keep": keep},
+            )
+
+    def stats(self):
+        stats = self.memory.stats()
+        stats["persist"] = self.persist
+        stats["persistent_hits"] = self.persistent_hits
+        # 메모리/테이블 어디에도 없어서 새로 인코딩한 횟수
+        stats["encodes"] = stats["misses"] - self.persistent_hits
+        return stats
+
+
+query_embedding_cache = QueryEmbeddingCache()
+
+
+class ResultCache:
+    """추천 결과 캐시 (TTL + LRU).
+
+    review/product/reviewer 에 쓰기가 일어나면 트리거가 data_version 시퀀스를 올리고,
+    값이 바뀐 것을 보면 캐시 전체를 비운다. 이 프로세스의 crud 쓰기는 invalidate() 로 바로 비운다.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = RESULT_CACHE_SIZE,
+        ttl: float = RESULT_CACHE_TTL,
+        poll_seconds: float = DATA_VERSION_POLL_SECONDS,
+    ):
+        self.memory = LRUCache(maxsize, ttl)
+        self.poll_seconds = poll_seconds
+        self.data_version = None
+        self.invalidations = 0
+        self._checked_at = 0.0
+
+    def invalidate(self):
+        self.memory.clear()
+        self.invalidations += 1
+        # 다음 요청에서 data_version 을 다시 읽는다
+        self._checked_at = 0.0
+
+    async def check_version(self, db):
+        if time.monotonic() - self._checked_at < self.poll_seconds:
+            return
+        result = await db.execute(
+            text("SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM data_version")
+        )
+        version = result.scalar()
+        self._checked_at = time.monotonic()
+        if version != self.data_version:
+            if self.data_version is not None:
+                self.memory.clear()
+                self.invalidations += 1
+            self.data_version = version
+
+    async def get_or_compute(self, db, key, compute):
+        # compute 는 결과를 계산하는 코루틴 함수. DataFrame 은 복사본을 돌려준다.
+        if self.memory.maxsize <= 0:
+            return await compute()
+        await self.check_version(db)
+        value = self.memory.get(key)
+        if value is None:
+            value = await compute()
+            self.memory.put(key, value)
+        return value.copy() if hasattr(value, "copy") else value
+
+    def stats(self):
+        stats = self.memory.stats()
+        stats["data_version"] = self.data_version
+        stats["invalidations"] = self.invalidations
+        return stats
+
+
+result_cache = ResultCache()
@@ -2,14 +2,28 @@ from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import joinedload
 from . import models, schemas
-import ast
-from sentence_transformers import SentenceTransformer
+from .embedding import embedding_service
+from .vector_index import vector_index
+from .recsys import category_index
+from .cache import result_cache
 
-model = SentenceTransformer("bespin-global/klue-sroberta-base-continue-learning-by-mnr")
 
+async def generate_embedding(text):
+    return await embedding_service.encode(text)
 
-def generate_embedding(text):
-    return str(model.encode([text])[0].tolist())
+
+def review_index_entry(db_review):
+    # 인메모리 벡터 인덱스에 필요한 값 (커밋 전에 잡아 둔다)
+    return (
+        db_review.product_id,
+        db_review.used_over_one_month,
+        db_review.review_content_embedding,
+    )
+
+
+def apply_review_to_vector_index(xact_id, entry, sign=1):
+    # 인메모리 벡터 인덱스에 리뷰 변경분 반영 (수정은 -1 후 +1). 커밋이 성공한 뒤에만 호출한다.
+    vector_index.apply_review(xact_id, *entry, sign)
 
 
 # CRUD functions for Reviewer
@@ -43,6 +57,7 @@ async def update_reviewer(
         setattr(db_reviewer, key, value)
     await db.commit()
     await db.refresh(db_reviewer)
+    result_cache.invalidate()
     return db_reviewer
 
 
@@ -50,8 +65,19 @@ async def delete_reviewer(db: AsyncSession, reviewer_id: int):
     db_reviewer = await get_reviewer(db, reviewer_id)
     if not db_reviewer:
         return None
+    db_reviews = []
+    if vector_index.loaded:
+        # cascade 로 함께 삭제되는 리뷰도 인메모리 인덱스에 반영
+        result = await db.execute(
+            select(models.Review).where(models.Review.reviewer_id == reviewer_id)
+        )
+        db_reviews = [review_index_entry(db_review) for db_review in result.scalars().all()]
+    xact_id = await vector_index.transaction_id(db)
     await db.delete(db_reviewer)
     await db.commit()
+    for entry in db_reviews:
+        apply_review_to_vector_index(xact_id, entry, sign=-1)
+    result_cache.invalidate()
     return db_reviewer
 
 
@@ -60,39 +86,28 @@ async def get_product(db: AsyncSession, product_id: int):
     result = await db.execute(
         select(models.Product).where(models.Product.product_id == product_id)
     )
-    db_product = result.scalars().first()
-    db_product.product_name_embedding = ast.literal_eval(
-        db_product.product_name_embedding
-    )
-
-    return db_product
+    return result.scalars().first()
 
 
 async def get_products(db: AsyncSession, skip: int = 0, limit: int = 100):
     result = await db.execute(select(models.Product).offset(skip).limit(limit))
-    db_products = result.scalars().all()
-    for db_product in db_products:
-        db_product.product_name_embedding = ast.literal_eval(
-            db_product.product_name_embedding
-        )
-    return db_products
+    return result.scalars().all()
 
 
 async def create_product(db: AsyncSession, product: schemas.ProductCreate):
     ## whenever product is created, generate embedding for product name
     product_dict = product.dict()
-    embedding = generate_embedding(product_dict.get("product_name"))
+    embedding = await generate_embedding(product_dict.get("product_name"))
     product_dict["product_name_embedding"] = embedding
     db_product = models.Product(**product_dict)
 
     db.add(db_product)
+    xact_id = await vector_index.transaction_id(db)
     await db.commit()
     await db.refresh(db_product)
-
-    ## for pydantic validation, convert string to list
-    db_product.product_name_embedding = ast.literal_eval(
-        db_product.product_name_embedding
-    )
+    vector_index.apply_product(xact_id, db_product.product_id, db_product.product_name_embedding)
+    category_index.invalidate()
+    result_cache.invalidate()
     return db_product
 
 
@@ -104,14 +119,14 @@ async def update_product(
         return None
     for key, value in product_update.dict().items():
         setattr(db_product, key, value)
-    db_product.product_name_embedding = generate_embedding(db_product.product_name)
+    db_product.product_name_embedding = await generate_embedding(db_product.product_name)
 
+    xact_id = await vector_index.transaction_id(db)
     await db.commit()
     await db.refresh(db_product)
-
-    db_product.product_name_embedding = ast.literal_eval(
-        db_product.product_name_embedding
-    )
+    vector_index.apply_product(xact_id, db_product.product_id, db_product.product_name_embedding)
+    category_index.invalidate()
+    result_cache.invalidate()
     return db_product
 
 
@@ -119,8 +134,12 @@ async def delete_product(db: AsyncSession, product_id: int):
     db_product = await get_product(db, product_id)
     if not db_product:
         return None
+    xact_id = await vector_index.transaction_id(db)
     await db.delete(db_product)
     await db.commit()
+    vector_index.apply_product(xact_id, product_id, None)
+    category_index.invalidate()
+    result_cache.invalidate()
     return db_product
 
 
@@ -129,41 +148,27 @@ async def get_review(db: AsyncSession, review_id: int):
     result = await db.execute(
         select(models.Review).where(models.Review.review_id == review_id)
     )
-    db_review = result.scalars().first()
-    if db_review:
-        db_review.review_content_embedding = ast.literal_eval(
-            db_review.review_content_embedding
-        )
-    return db_review
+    return result.scalars().first()
 
 
 async def get_reviews(db: AsyncSession, skip: int = 0, limit: int = 100):
     result = await db.execute(select(models.Review).offset(skip).limit(limit))
-    db_reviews = result.scalars().all()
-
-    for db_review in db_reviews:
-        db_review.review_content_embedding = ast.literal_eval(
-            db_review.review_content_embedding
-        )
-
-    return db_reviews
+    return result.scalars().all()
 
 
 async def create_review(db: AsyncSession, review: schemas.ReviewCreate):
     ## whenever review is created, generate embedding for review content
     review_dict = review.dict()
-    embedding = generate_embedding(review_dict.get("review_content"))
+    embedding = await generate_embedding(review_dict.get("review_content"))
     review_dict["review_content_embedding"] = embedding
 
     db_review = models.Review(**review_dict)
     db.add(db_review)
+    xact_id = await vector_index.transaction_id(db)
     await db.commit()
     await db.refresh(db_review)
-
-    ## for pydantic validation, convert string to list
-    db_review.review_content_embedding = ast.literal_eval(
-        db_review.review_content_embedding
-    )
+    apply_review_to_vector_index(xact_id, review_index_entry(db_review))
+    result_cache.invalidate()
     return db_review
 
 
@@ -173,14 +178,16 @@ async def update_review(
     db_review = await get_review(db, review_id)
     if not db_review:
         return None
+    old_entry = review_index_entry(db_review)
     for key, value in review_update.dict().items():
         setattr(db_review, key, value)
-    db_review.review_content_embedding = generate_embedding(db_review.review_content)
+    db_review.review_content_embedding = await generate_embedding(db_review.review_content)
+    xact_id = await vector_index.transaction_id(db)
     await db.commit()
     await db.refresh(db_review)
-    db_review.review_content_embedding = ast.literal_eval(
-        db_review.review_content_embedding
-    )
+    apply_review_to_vector_index(xact_id, old_entry, sign=-1)
+    apply_review_to_vector_index(xact_id, review_index_entry(db_review))
+    result_cache.invalidate()
     return db_review
 
 
@@ -188,6 +195,10 @@ async def delete_review(db: AsyncSession, review_id: int):
     db_review = await get_review(db, review_id)
     if not db_review:
         return None
+    entry = review_index_entry(db_review)
+    xact_id = await vector_index.transaction_id(db)
     await db.delete(db_review)
     await db.commit()
+    apply_review_to_vector_index(xact_id, entry, sign=-1)
+    result_cache.invalidate()
     return db_review
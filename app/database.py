@@ -1,15 +1,45 @@
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import event
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+# 연결별 asyncpg prepared statement 캐시 크기 (recsys 쿼리는 고정 문장이라 한 번만 prepare 된다)
+PREPARED_STATEMENT_CACHE_SIZE = int(os.getenv("PREPARED_STATEMENT_CACHE_SIZE", "500"))
+
+
+engine = create_async_engine(
+    DATABASE_URL,
+    echo=True,
+    connect_args={"prepared_statement_cache_size": PREPARED_STATEMENT_CACHE_SIZE},
+)
+
+
+async def _register_vector_codec(conn):
+    from .models import decode_vector, encode_vector
+
+    try:
+        await conn.set_type_codec(
+            "vector",
+            schema="public",
+            encoder=encode_vector,
+            decoder=decode_vector,
+            format="binary",
+        )
+    except ValueError:
+        # vector 확장이 아직 설치되지 않은 DB (startup 에서 설치 후 재연결)
+        pass
+
+
+@event.listens_for(engine.sync_engine, "connect")
+def register_vector_codec(dbapi_connection, connection_record):
+    dbapi_connection.run_async(_register_vector_codec)
 
 
-engine = create_async_engine(DATABASE_URL, echo=True)
 SessionLocal = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
 
 Base = declarative_base()
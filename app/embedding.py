@@ -0,0 +1,162 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+MODEL_NAME = "bespin-global/klue-sroberta-base-continue-learning-by-mnr"
+
+# 마이크로 배치 설정 (.env 로 조정 가능)
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "32"))
+EMBEDDING_MAX_WAIT_MS = float(os.getenv("EMBEDDING_MAX_WAIT_MS", "10"))
+# 추론을 실행할 풀 종류 (thread | process) 와 워커 수
+EMBEDDING_EXECUTOR = os.getenv("EMBEDDING_EXECUTOR", "thread")
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "1"))
+
+# 프로세스 풀 워커마다 한 번 로드되는 모델
+_worker_model = None
+
+
+def _init_worker(model_name: str):
+    global _worker_model
+    _worker_model = SentenceTransformer(model_name)
+
+
+def _encode_in_worker(texts, batch_size=None):
+    return _worker_model.encode(texts, batch_size=batch_size or len(texts))
+
+
+def create_executor(kind: str, workers: int, model_name: str = MODEL_NAME, mp_context=None) -> Executor:
+    if kind == "process":
+        return ProcessPoolExecutor(
+            max_workers=workers, mp_context=mp_context, initializer=_init_worker, initargs=(model_name,)
+        )
+    if kind == "thread":
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embedding")
+    raise ValueError(f"Unknown embedding executor: {kind}")
+
+
+class EmbeddingService:
+    """프로세스 전체에서 공유하는 문장 임베딩 서비스.
+
+    동시에 들어온 encode 요청을 큐에 모아 최대 ``max_batch_size`` 개 또는
+    ``max_wait_ms`` 동안 기다린 뒤 한 번의 ``model.encode`` 로 처리한다.
+    추론은 스레드/프로세스 풀에서 실행되므로 이벤트 루프를 막지 않는다.
+    """
+
+    def __init__(
+        self,
+        model_name: str = MODEL_NAME,
+        max_batch_size: int = EMBEDDING_MAX_BATCH_SIZE,
+        max_wait_ms: float = EMBEDDING_MAX_WAIT_MS,
+        executor: str = EMBEDDING_EXECUTOR,
+        workers: int = EMBEDDING_WORKERS,
+    ):
+        self.model_name = model_name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.executor_kind = executor
+        self.workers = workers
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._executor = None
+        self._batches = set()
+        self._slots = None
+        self._queue = None
+        self._worker = None
+        self._loop = None
+
+    @property
+    def model(self) -> SentenceTransformer:
+        # 모델은 처음 사용할 때 한 번만 로드
+        with self._model_lock:
+            if self._model is None:
+                self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    def encode_sync(self, texts, batch_size: int = 32) -> np.ndarray:
+        # 이벤트 루프 밖(스크립트 등)에서 사용하는 동기 버전
+        return self.model.encode(list(texts), batch_size=batch_size)
+
+    async def encode(self, text: str) -> np.ndarray:
+        # 잘못된 입력이 같은 배치의 다른 요청까지 실패시키지 않도록 큐에 넣기 전에 거른다
+        if not isinstance(text, str):
+            raise TypeError(f"text must be str, not {type(text).__name__}")
+        self._ensure_worker()
+        future = self._loop.create_future()
+        await self._queue.put((text, future))
+        return await future
+
+    async def encode_many(self, texts) -> list:
+        return list(await asyncio.gather(*(self.encode(text) for text in texts)))
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.workers)
+            self._worker = loop.create_task(self._batch_worker())
+        if self._executor is None:
+            self._executor = create_executor(
+                self.executor_kind, self.workers, self.model_name
+            )
+
+    def _encode_batch(self, texts):
+        return self.model.encode(texts, batch_size=len(texts))
+
+    async def _batch_worker(self):
+        while True:
+            # 모든 워커가 바쁜 동안 들어온 요청은 다음 배치로 모인다
+            await self._slots.acquire()
+            batch = [await self._queue.get()]
+            deadline = self._loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            task = self._loop.create_task(self._run_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _run_batch(self, batch):
+        try:
+            await self._encode_into(batch)
+        finally:
+            self._slots.release()
+
+    async def _encode_into(self, batch):
+        texts = [text for text, _ in batch]
+        encode = _encode_in_worker if self.executor_kind == "process" else self._encode_batch
+        try:
+            embeddings = await self._loop.run_in_executor(self._executor, encode, texts)
+        except Exception as e:
+            if len(batch) > 1:
+                # 배치가 실패하면 한 건씩 다시 실행해서 문제가 된 요청만 실패시킨다
+                for item in batch:
+                    await self._encode_into([item])
+                return
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), embedding in zip(batch, embeddings):
+            if not future.done():
+                future.set_result(embedding)
+
+    def shutdown(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# crud, recsys 가 함께 사용하는 단일 인스턴스
+embedding_service = EmbeddingService()
@@ -1,11 +1,20 @@
-from fastapi import FastAPI, Depends, HTTPException, Body
+from fastapi import FastAPI, Depends, HTTPException, Body, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import joinedload
-from . import crud, schemas, recsys, review_search
-from .database import engine, Base, get_db
-from typing import List, Dict, Any
+from . import crud, schemas, recsys, review_search, migrations
+from .embedding import embedding_service
+from .cache import query_embedding_cache, result_cache
+from .vector_index import vector_index, build_snapshot, VECTOR_INDEX_REBUILD_SECONDS
+from .score_engine import score_engine
+from .batch_recsys import iter_batch_recommendations, BATCH_TOP_N_MAX
+from .reviewer_recommendation import compute_reviewer_recommendations, get_reviewer_recommendations
+from .database import engine, Base, get_db, SessionLocal
+from typing import List, Dict, Any, Literal, Optional
 from sqlalchemy import text
 from datetime import datetime
+import json
+import asyncio
 
 
 app = FastAPI()
@@ -14,6 +23,11 @@ app = FastAPI()
 # 데이터베이스 초기화
 @app.on_event("startup")
 async def startup():
+    # vector 확장 설치 후 재연결해야 모든 연결에 바이너리 vector 코덱이 등록된다
+    async with engine.begin() as conn:
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+    await engine.dispose()
+
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
         # 시퀀스 값을 최대값보다 높은 값으로 설정
@@ -37,38 +51,39 @@ async def startup():
             """
             )
         )
-        # 트리거 함수 생성
-        trigger_function_sql = """
-        CREATE OR REPLACE FUNCTION update_product_review_stats()
-        RETURNS TRIGGER AS $$
-        BEGIN
-            -- 제품 평점 및 리뷰 수 업데이트
-            UPDATE product
-            SET number_of_reviews = number_of_reviews + 1,
-                review_rating = CEIL((SELECT AVG(rating) FROM review WHERE product_id = NEW.product_id))
-            WHERE product_id = NEW.product_id;
-            RETURN NEW;
-        END;
-        $$ LANGUAGE plpgsql;
-        """
-        await conn.execute(text(trigger_function_sql))
-
-        # 기존 트리거 삭제
-        await conn.execute(
-            text("DROP TRIGGER IF EXISTS review_insert_trigger ON review")
-        )
-
-        # 트리거 생성
-        trigger_sql = """
-        CREATE TRIGGER review_insert_trigger
-        AFTER INSERT ON review
-        FOR EACH ROW
-        EXECUTE FUNCTION update_product_review_stats();
-        """
-        await conn.execute(text(trigger_sql))
+        # 제품 리뷰 통계 트리거 (리뷰 추가/수정/삭제 시 증분 갱신)
+        await migrations.create_product_review_stats_triggers(conn)
 
         # 인덱스 생성
         await conn.execute(text("CREATE INDEX IF NOT EXISTS idx_reviewer_id ON review (reviewer_id);"))
+        await migrations.create_vector_indexes(conn)
+        await migrations.create_product_indexes(conn)
+        await migrations.create_review_search_indexes(conn)
+        await migrations.create_product_review_centroid_trigger(conn)
+        await migrations.create_reviewer_signature_rating_triggers(conn)
+        await migrations.create_recommendation_stale_triggers(conn)
+        await migrations.create_data_version_triggers(conn)
+
+    await query_embedding_cache.prune()
+
+    # VECTOR_INDEX_DIR 가 설정된 경우 인메모리 벡터 인덱스 스냅샷을 로드 (없으면 생성)
+    if vector_index.path and not vector_index.load():
+        async with SessionLocal() as db:
+            await build_snapshot(db, vector_index.path)
+        vector_index.load()
+    # 다른 워커/배치의 쓰기를 반영하도록 주기적으로 스냅샷을 다시 만든다
+    if vector_index.path and VECTOR_INDEX_REBUILD_SECONDS > 0:
+        app.state.vector_index_rebuild = asyncio.create_task(
+            vector_index.run_rebuild_loop(SessionLocal)
+        )
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    rebuild_task = getattr(app.state, "vector_index_rebuild", None)
+    if rebuild_task is not None:
+        rebuild_task.cancel()
+    embedding_service.shutdown()
 
 
 # 간단한 테스트 엔드포인트 추가
@@ -82,6 +97,23 @@ async def test_db_connection(db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/cache/stats")
+async def cache_stats():
+    return {
+        "query_embedding": query_embedding_cache.stats(),
+        "result": result_cache.stats(),
+    }
+
+
+@app.post("/vector_index/snapshot")
+async def rebuild_vector_index(db: AsyncSession = Depends(get_db)):
+    if not vector_index.path:
+        raise HTTPException(status_code=400, detail="VECTOR_INDEX_DIR is not configured")
+    snapshot_dir = await build_snapshot(db, vector_index.path)
+    vector_index.load()
+    return {"snapshot": snapshot_dir}
+
+
 # Reviewer CRUD endpoints
 @app.post("/reviewers/", response_model=schemas.Reviewer)
 async def create_reviewer(
@@ -214,26 +246,91 @@ async def delete_review(review_id: int, db: AsyncSession = Depends(get_db)):
     return db_review
 
 
+# 리뷰 목록은 {"items", "next_cursor", "limit"} 페이지로 반환. 다음 페이지는 cursor=next_cursor 로 요청
+PAGE_LIMIT = Query(review_search.REVIEW_PAGE_SIZE, ge=1, le=review_search.REVIEW_PAGE_SIZE_MAX)
+
+
 @app.get("/reviews/product/{product_name}/keyword/{keyword}")
 async def get_reviews_by_product_and_keyword(
-    product_name: str, keyword: str, db: AsyncSession = Depends(get_db)
+    product_name: str,
+    keyword: str,
+    ranked: bool = False,
+    limit: int = PAGE_LIMIT,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
 ):
-    reviews = await review_search.get_reviews_by_product_and_keyword(
-        db, product_name, keyword
-    )
-    return reviews.to_dict(orient="records")
+    """제품명에 product_name 다음으로 keyword 가 들어간 리뷰를 review_id 순으로 조회한다.
+
+    ranked=true 이면 keyword 를 포함하거나 비슷한 review_content 를 가진 리뷰(제품명은 product_name 포함)도
+    함께 찾고, 단어 유사도(score) 순으로 정렬한다.
+    """
+    try:
+        return await review_search.get_reviews_by_product_and_keyword(
+            db, product_name, keyword, ranked, limit, cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.get("/reviews/product/{product_id}/{rating}")
-async def get_reviews_by_rating(product_id: int, rating: int, db: AsyncSession = Depends(get_db)):
-    reviews = await review_search.get_reviews_by_rating(db, product_id, rating)
-    return reviews.to_dict(orient="records")
+async def get_reviews_by_rating(
+    product_id: int, rating: int, limit: int = PAGE_LIMIT, cursor: Optional[str] = None, db: AsyncSession = Depends(get_db)
+):
+    try:
+        return await review_search.get_reviews_by_rating(db, product_id, rating, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.get("/reviews/dates/")
-async def get_reviews_by_date_range(start_date: datetime, end_date: datetime, db: AsyncSession = Depends(get_db)):
-    reviews = await review_search.get_reviews_by_date_range(db, start_date, end_date)
-    return reviews.to_dict(orient="records")
+async def get_reviews_by_date_range(
+    start_date: datetime,
+    end_date: datetime,
+    limit: int = PAGE_LIMIT,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    try:
+        return await review_search.get_reviews_by_date_range(db, start_date, end_date, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+# 전체 결과 내보내기. 서버 측 커서로 읽으면서 NDJSON/CSV 로 스트리밍한다 (페이지/개수 제한 없음)
+@app.get("/reviews/product/{product_name}/keyword/{keyword}/stream")
+async def stream_reviews_by_product_and_keyword(
+    product_name: str, keyword: str, format: Literal["ndjson", "csv"] = "ndjson"
+):
+    body, media_type = review_search.stream_reviews(
+        review_search.reviews_by_keyword_query(product_name, keyword), format
+    )
+    return StreamingResponse(body, media_type=media_type)
+
+
+@app.get("/reviews/product/{product_id}/{rating}/stream")
+async def stream_reviews_by_rating(product_id: int, rating: int, format: Literal["ndjson", "csv"] = "ndjson"):
+    body, media_type = review_search.stream_reviews(
+        review_search.reviews_by_rating_query(product_id, rating), format
+    )
+    return StreamingResponse(body, media_type=media_type)
+
+
+@app.get("/reviews/dates/stream")
+async def stream_reviews_by_date_range(
+    start_date: datetime, end_date: datetime, format: Literal["ndjson", "csv"] = "ndjson"
+):
+    body, media_type = review_search.stream_reviews(
+        review_search.reviews_by_date_range_query(start_date, end_date), format
+    )
+    return StreamingResponse(body, media_type=media_type)
+
+
+@app.get("/reviews/brand/{brand_name}/stream")
+async def stream_reviews_by_brand(brand_name: str, format: Literal["ndjson", "csv"] = "ndjson"):
+    body, media_type = review_search.stream_reviews(
+        review_search.reviews_by_brand_query(brand_name), format
+    )
+    return StreamingResponse(body, media_type=media_type)
 
 
 @app.get("/reviews/summary/{product_id}")
@@ -252,36 +349,111 @@ async def get_brand_review_ratios(brand_name: str, db: AsyncSession = Depends(ge
 async def recsys_product_SS_CBFCF(
     query: str,
     user_vector: Dict[str, Any] = Body(...),
+    search_mode: Literal["exact", "scan", "memory"] = "exact",
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None,
+    scoring: Literal["sql", "numpy"] = "sql",
     db: AsyncSession = Depends(get_db),
 ):
-    recommend = await recsys.get_final_recommendations(db, user_vector, query)
-    filter_recommend = await recsys.get_top_products_by_category(db, recommend, query)
-    # await recsys.create_view_from_df(db, top_products, "top_product_view", query)
-    # recommend = await recsys.execute_custom_query(db, text("SELECT product_category, product_id, product_name FROM top_product_view;"))
-    return filter_recommend.to_dict(orient="records")
+    # 후보 필터, 카테고리 필터, 상위 10개 선택이 모두 한 쿼리에서 처리된다
+    # (scoring 은 search_mode=memory 에서 CBF/CF 후보를 계산할 때 사용,
+    #  ef_search/probes 는 ann 전용이라 지정하면 400)
+    try:
+        recommend = await recsys.get_final_recommendations(
+            db, user_vector, query, search_mode=search_mode, ef_search=ef_search, probes=probes,
+            scoring=scoring,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return recommend.to_dict(orient="records")
 
 
 @app.get("/recsys2")
 async def recsys_product_CBFCF(
-    user_vector: Dict[str, Any] = Body(...), db: AsyncSession = Depends(get_db)
+    user_vector: Dict[str, Any] = Body(...),
+    scoring: Literal["sql", "numpy"] = "sql",
+    db: AsyncSession = Depends(get_db),
 ):
-    recommend = await recsys.calculate_final_scores(db, user_vector)
+    recommend = await recsys.calculate_final_scores(db, user_vector, scoring)
     filter_recommend = await recsys.get_top_products_by_category(db, recommend)
     # await recsys.create_view_from_df(db, top_products, "top_product_view")
     # recommend = await recsys.execute_custom_query(db, text("SELECT product_id, product_category, product_name FROM top_product_view;"))
     return filter_recommend.to_dict(orient="records")
 
 
+@app.get("/recsys2/reviewer/{reviewer_id}")
+async def recsys_reviewer(reviewer_id: int, db: AsyncSession = Depends(get_db)):
+    # 배치 작업이 저장한 결과를 조회. 아직 없으면 이 리뷰어만 계산해서 저장한다.
+    recommend = await get_reviewer_recommendations(db, reviewer_id)
+    if recommend is None:
+        if not await compute_reviewer_recommendations(db, reviewer_id=reviewer_id):
+            raise HTTPException(status_code=404, detail="Reviewer not found")
+        recommend = await get_reviewer_recommendations(db, reviewer_id)
+    return recommend
+
+
+@app.post("/reviewer_recommendation/refresh")
+async def refresh_reviewer_recommendations(db: AsyncSession = Depends(get_db)):
+    # 리뷰/제품 변경으로 stale 표시된 리뷰어(와 결과가 없는 리뷰어)만 다시 계산
+    count = await compute_reviewer_recommendations(db, stale_only=True)
+    return {"recomputed": count}
+
+
 @app.get("/recsys3/{query}")
-async def recsys_product_SS(query: str, db: AsyncSession = Depends(get_db)):
-    top_products = await recsys.get_top_products_by_similarity(
-        db, query, alpha=1.0, beta=1.0, gamma=1.5, top_n=10
-    )
-    await recsys.create_view_from_df(db, top_products, "top_product_view", query)
-    recommend = await recsys.execute_custom_query(
-        db,
-        text(
-            "SELECT product_id, product_category, product_name, brand_name, original_price, final_price FROM top_product_view;"
-        ),
+async def recsys_product_SS(
+    query: str,
+    materialize_view: bool = False,
+    search_mode: Literal["exact", "scan", "ann", "memory"] = "exact",
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    try:
+        return await _recsys_product_SS(db, query, materialize_view, search_mode, ef_search, probes)
+    except ValueError as e:
+        # ef_search 가 ann 후보 수보다 작거나 pgvector 최대값을 넘는 경우, ann 이 아닌 검색에 ef_search/probes 를 준 경우
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def _recsys_product_SS(db, query, materialize_view, search_mode, ef_search, probes):
+    if materialize_view:
+        # 세션 전용 TEMP VIEW 로 결과를 만들어 조회 (명시적 opt-in)
+        top_products = await recsys.get_top_products_by_similarity(
+            db, query, alpha=1.0, beta=1.0, gamma=1.5, top_n=10,
+            search_mode=search_mode, ef_search=ef_search, probes=probes,
+        )
+        await recsys.create_view_from_df(db, top_products, "top_product_view", query)
+        recommend = await recsys.execute_custom_query(
+            db,
+            text(
+                "SELECT product_id, product_category, product_name, brand_name, original_price, final_price FROM top_product_view;"
+            ),
+        )
+        return recommend.to_dict(orient="records")
+
+    recommend = await recsys.get_top_products_with_details(
+        db, query, alpha=1.0, beta=1.0, gamma=1.5, top_n=10,
+        search_mode=search_mode, ef_search=ef_search, probes=probes,
     )
     return recommend.to_dict(orient="records")
+
+
+@app.post("/recsys/batch")
+async def recsys_batch(
+    user_vectors: List[schemas.UserVector],
+    top_n: int = Query(10, ge=1, le=BATCH_TOP_N_MAX),
+    db: AsyncSession = Depends(get_db),
+):
+    # 여러 프로필의 recsys2 점수를 행렬 연산으로 한 번에 계산해 NDJSON 으로 스트리밍
+    # 마지막 줄은 {"stats": {"profiles", "seconds", "profiles_per_second"}}
+    await score_engine.refresh(db)
+    # 제너레이터는 스레드풀에서 실행되므로, 도중의 refresh 와 섞이지 않게 스냅샷을 미리 잡아 둔다
+    snapshot = score_engine.snapshot
+    profiles = [recsys.user_vector_params(user_vector.dict()) for user_vector in user_vectors]
+
+    def generate():
+        stats = {}
+        yield from iter_batch_recommendations(profiles, top_n, stats, snapshot)
+        yield json.dumps({"stats": stats}) + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
@@ -0,0 +1,742 @@
+import os
+from sqlalchemy import text
+from .models import EMBEDDING_DIM
+
+# 임베딩 ANN 인덱스 설정 (hnsw | ivfflat)
+VECTOR_INDEX_METHOD = os.getenv("VECTOR_INDEX_METHOD", "hnsw")
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+IVFFLAT_LISTS = int(os.getenv("IVFFLAT_LISTS", "100"))
+
+VECTOR_INDEXED_COLUMNS = [
+    ("review", "review_content_embedding"),
+    ("product", "product_name_embedding"),
+]
+
+
+def vector_index_sql(table: str, column: str, method: str = VECTOR_INDEX_METHOD) -> str:
+    if method == "hnsw":
+        options = f"(m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION})"
+    elif method == "ivfflat":
+        options = f"(lists = {IVFFLAT_LISTS})"
+    else:
+        raise ValueError(f"Unknown vector index method: {method}")
+    return f"""
+    CREATE INDEX IF NOT EXISTS idx_{table}_{column}_{method}
+    ON {table} USING {method} ({column} vector_cosine_ops)
+    WITH {options};
+    """
+
+
+async def create_vector_indexes(conn):
+    # 코사인 거리(<=>) 검색용 ANN 인덱스
+    for table, column in VECTOR_INDEXED_COLUMNS:
+        await conn.execute(text(vector_index_sql(table, column)))
+    # ANN 후보 제품의 리뷰를 정확히 다시 집계할 때 사용
+    await conn.execute(
+        text("CREATE INDEX IF NOT EXISTS idx_review_product_id ON review (product_id);")
+    )
+
+
+async def create_product_indexes(conn):
+    # 카테고리 키워드 검색 시 후보 제품 조회용
+    await conn.execute(
+        text("CREATE INDEX IF NOT EXISTS idx_product_category ON product (product_category);")
+    )
+
+
+# 리뷰 키워드 검색 (LIKE '%...%' 와 pg_trgm 유사도 연산자 <%) 용 trigram GIN 인덱스
+REVIEW_TRGM_INDEXED_COLUMNS = [
+    ("review", "product_name"),
+    ("review", "review_content"),
+]
+
+
+async def create_review_search_indexes(conn):
+    await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    for table, column in REVIEW_TRGM_INDEXED_COLUMNS:
+        await conn.execute(
+            text(
+                f"CREATE INDEX IF NOT EXISTS idx_{table}_{column}_trgm "
+                f"ON {table} USING gin ({column} gin_trgm_ops);"
+            )
+        )
+    # 리뷰 목록 keyset 페이지네이션 정렬 순서와 같은 복합 인덱스
+    await conn.execute(
+        text("CREATE INDEX IF NOT EXISTS idx_review_date_id ON review (review_date, review_id);")
+    )
+    await conn.execute(
+        text("CREATE INDEX IF NOT EXISTS idx_review_product_rating_id ON review (product_id, rating, review_id);")
+    )
+
+
+# 제품별 리뷰 centroid 유지 트리거
+# 정규화된 리뷰 임베딩의 합과 개수를 저장하므로 평균 벡터 = 합 / 개수 이고,
+# AVG(1 - (r <=> q)) = (합 · q_normalized) / 개수 가 된다.
+CENTROID_TERM_FUNCTION_SQL = f"""
+CREATE OR REPLACE FUNCTION centroid_term(embedding vector, include boolean)
+RETURNS vector AS $$
+    SELECT CASE
+        WHEN include AND embedding IS NOT NULL THEN l2_normalize(embedding)
+        ELSE array_fill(0::real, ARRAY[{EMBEDDING_DIM}])::vector
+    END;
+$$ LANGUAGE sql IMMUTABLE;
+"""
+
+PRODUCT_REVIEW_CENTROID_FUNCTION_SQL = """
+CREATE OR REPLACE FUNCTION update_product_review_centroid()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE product_review_centroid
+        SET review_count = review_count - 1,
+            used_count = used_count - (OLD.used_over_one_month IS TRUE)::int,
+            embedding_count = embedding_count - (OLD.review_content_embedding IS NOT NULL)::int,
+            used_embedding_count = used_embedding_count
+                - (OLD.used_over_one_month IS TRUE AND OLD.review_content_embedding IS NOT NULL)::int,
+            embedding_sum = embedding_sum - centroid_term(OLD.review_content_embedding, true),
+            used_embedding_sum = used_embedding_sum
+                - centroid_term(OLD.review_content_embedding, OLD.used_over_one_month IS TRUE)
+        WHERE product_id = OLD.product_id;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO product_review_centroid AS c (
+            product_id, review_count, used_count, embedding_count, used_embedding_count,
+            embedding_sum, used_embedding_sum
+        )
+        VALUES (
+            NEW.product_id,
+            1,
+            (NEW.used_over_one_month IS TRUE)::int,
+            (NEW.review_content_embedding IS NOT NULL)::int,
+            (NEW.used_over_one_month IS TRUE AND NEW.review_content_embedding IS NOT NULL)::int,
+            centroid_term(NEW.review_content_embedding, true),
+            centroid_term(NEW.review_content_embedding, NEW.used_over_one_month IS TRUE)
+        )
+        ON CONFLICT (product_id) DO UPDATE
+        SET review_count = c.review_count + EXCLUDED.review_count,
+            used_count = c.used_count + EXCLUDED.used_count,
+            embedding_count = c.embedding_count + EXCLUDED.embedding_count,
+            used_embedding_count = c.used_embedding_count + EXCLUDED.used_embedding_count,
+            embedding_sum = c.embedding_sum + EXCLUDED.embedding_sum,
+            used_embedding_sum = c.used_embedding_sum + EXCLUDED.used_embedding_sum;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+PRODUCT_REVIEW_CENTROID_REBUILD_SQL = f"""
+INSERT INTO product_review_centroid (
+    product_id, review_count, used_count, embedding_count, used_embedding_count,
+    embedding_sum, used_embedding_sum
+)
+SELECT
+    product_id,
+    COUNT(*),
+    SUM((used_over_one_month IS TRUE)::int),
+    COUNT(review_content_embedding),
+    COUNT(review_content_embedding) FILTER (WHERE used_over_one_month IS TRUE),
+    COALESCE(SUM(l2_normalize(review_content_embedding)), array_fill(0::real, ARRAY[{EMBEDDING_DIM}])::vector),
+    COALESCE(
+        SUM(l2_normalize(review_content_embedding)) FILTER (WHERE used_over_one_month IS TRUE),
+        array_fill(0::real, ARRAY[{EMBEDDING_DIM}])::vector
+    )
+FROM review
+GROUP BY product_id;
+"""
+
+
+async def rebuild_product_review_centroids(conn):
+    # 누적 오차를 없애고 싶을 때 전체 재계산
+    await conn.execute(text("TRUNCATE product_review_centroid"))
+    await conn.execute(text(PRODUCT_REVIEW_CENTROID_REBUILD_SQL))
+
+
+async def create_product_review_centroid_trigger(conn):
+    await conn.execute(text(CENTROID_TERM_FUNCTION_SQL))
+    await conn.execute(text(PRODUCT_REVIEW_CENTROID_FUNCTION_SQL))
+    await conn.execute(
+        text("DROP TRIGGER IF EXISTS review_centroid_trigger ON review")
+    )
+    await conn.execute(
+        text(
+            """
+            CREATE TRIGGER review_centroid_trigger
+            AFTER INSERT OR DELETE OR UPDATE OF product_id, used_over_one_month, review_content_embedding
+            ON review
+            FOR EACH ROW
+            EXECUTE FUNCTION update_product_review_centroid();
+            """
+        )
+    )
+    # 처음 생성된 경우 기존 리뷰로 채운다
+    empty = await conn.execute(
+        text("SELECT NOT EXISTS (SELECT 1 FROM product_review_centroid)")
+    )
+    if empty.scalar():
+        await rebuild_product_review_centroids(conn)
+
+
+# 리뷰어 시그니처별 가중 평점 집계 (user-based CF 용)
+# 리뷰어 유사도는 아래 6개 그룹 합에만 의존하므로, 같은 시그니처의 리뷰어는 하나의 행으로 합친다.
+# 속성 중 하나라도 NULL 인 리뷰어는 유사도가 NULL 이 되어 원래 쿼리에서도 제외되므로 집계하지 않는다.
+SIGNATURE_COLUMNS = [
+    "sig_oily",
+    "sig_excess_sebum",
+    "sig_trouble",
+    "sig_combination",
+    "sig_whitening_wrinkles",
+    "sig_dry",
+]
+
+REVIEWER_SIGNATURE_ATTRIBUTES = [
+    "skin_type_oily",
+    "skin_concern_excess_sebum",
+    "skin_type_trouble_prone",
+    "skin_type_sensitive",
+    "skin_concern_trouble",
+    "skin_concern_atopy",
+    "skin_type_combination",
+    "skin_type_normal",
+    "skin_concern_whitening",
+    "skin_concern_wrinkles",
+    "skin_type_dry",
+    "skin_type_mildly_dry",
+]
+
+REVIEWER_SIGNATURE_FUNCTION_SQL = f"""
+CREATE OR REPLACE FUNCTION reviewer_signature(r reviewer)
+RETURNS int[] AS $$
+    SELECT CASE WHEN num_nulls({", ".join("r." + a for a in REVIEWER_SIGNATURE_ATTRIBUTES)}) = 0 THEN ARRAY[
+        r.skin_type_oily::int,
+        r.skin_concern_excess_sebum::int,
+        r.skin_type_trouble_prone::int + r.skin_type_sensitive::int + r.skin_concern_trouble::int + r.skin_concern_atopy::int,
+        r.skin_type_combination::int + r.skin_type_normal::int,
+        r.skin_concern_whitening::int + r.skin_concern_wrinkles::int,
+        r.skin_type_dry::int + r.skin_type_mildly_dry::int
+    ] END;
+$$ LANGUAGE sql IMMUTABLE;
+"""
+
+# 리뷰 한 건의 가중 평점 (재구매 의사가 있으면 1.5배)
+WEIGHTED_RATING_SQL = "{r}.rating * (CASE WHEN {r}.repurchase_intention THEN 1.5 ELSE 1 END)"
+
+APPLY_SIGNATURE_RATING_FUNCTION_SQL = f"""
+CREATE OR REPLACE FUNCTION apply_signature_rating(
+    sig int[], target_product_id int, rating_sum numeric, rated int, reviews int
+)
+RETURNS void AS $$
+BEGIN
+    IF sig IS NULL THEN
+        RETURN;
+    END IF;
+    INSERT INTO reviewer_signature_rating AS s (
+        {", ".join(SIGNATURE_COLUMNS)}, product_id, weighted_rating_sum, rated_count, review_count
+    )
+    VALUES (sig[1], sig[2], sig[3], sig[4], sig[5], sig[6], target_product_id, rating_sum, rated, reviews)
+    ON CONFLICT ({", ".join(SIGNATURE_COLUMNS)}, product_id) DO UPDATE
+    SET weighted_rating_sum = s.weighted_rating_sum + EXCLUDED.weighted_rating_sum,
+        rated_count = s.rated_count + EXCLUDED.rated_count,
+        review_count = s.review_count + EXCLUDED.review_count;
+    DELETE FROM reviewer_signature_rating
+    WHERE ({", ".join(SIGNATURE_COLUMNS)}) = (sig[1], sig[2], sig[3], sig[4], sig[5], sig[6])
+      AND product_id = target_product_id
+      AND review_count <= 0;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+REVIEW_SIGNATURE_RATING_FUNCTION_SQL = f"""
+CREATE OR REPLACE FUNCTION update_signature_rating_on_review()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM apply_signature_rating(
+            (SELECT reviewer_signature(rv) FROM reviewer rv WHERE rv.reviewer_id = OLD.reviewer_id),
+            OLD.product_id,
+            -COALESCE({WEIGHTED_RATING_SQL.format(r="OLD")}, 0),
+            -(OLD.rating IS NOT NULL)::int,
+            -1
+        );
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM apply_signature_rating(
+            (SELECT reviewer_signature(rv) FROM reviewer rv WHERE rv.reviewer_id = NEW.reviewer_id),
+            NEW.product_id,
+            COALESCE({WEIGHTED_RATING_SQL.format(r="NEW")}, 0),
+            (NEW.rating IS NOT NULL)::int,
+            1
+        );
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+# 리뷰어의 피부 속성이 바뀌면 그 리뷰어의 리뷰를 이전 시그니처에서 새 시그니처로 옮긴다
+REVIEWER_SIGNATURE_RATING_FUNCTION_SQL = f"""
+CREATE OR REPLACE FUNCTION update_signature_rating_on_reviewer()
+RETURNS TRIGGER AS $$
+DECLARE
+    old_sig int[] := reviewer_signature(OLD);
+    new_sig int[] := reviewer_signature(NEW);
+    rec RECORD;
+BEGIN
+    IF old_sig IS NOT DISTINCT FROM new_sig THEN
+        RETURN NULL;
+    END IF;
+    FOR rec IN
+        SELECT
+            r.product_id,
+            COALESCE(SUM({WEIGHTED_RATING_SQL.format(r="r")}), 0) AS rating_sum,
+            COUNT(r.rating)::int AS rated,
+            COUNT(*)::int AS reviews
+        FROM review r
+        WHERE r.reviewer_id = NEW.reviewer_id
+        GROUP BY r.product_id
+    LOOP
+        PERFORM apply_signature_rating(old_sig, rec.product_id, -rec.rating_sum, -rec.rated, -rec.reviews);
+        PERFORM apply_signature_rating(new_sig, rec.product_id, rec.rating_sum, rec.rated, rec.reviews);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+REVIEWER_SIGNATURE_RATING_REBUILD_SQL = f"""
+INSERT INTO reviewer_signature_rating (
+    {", ".join(SIGNATURE_COLUMNS)}, product_id, weighted_rating_sum, rated_count, review_count
+)
+SELECT
+    {", ".join(f"g.sig[{i + 1}]" for i in range(len(SIGNATURE_COLUMNS)))},
+    r.product_id,
+    COALESCE(SUM({WEIGHTED_RATING_SQL.format(r="r")}), 0),
+    COUNT(r.rating),
+    COUNT(*)
+FROM review r
+JOIN (SELECT rv.reviewer_id, reviewer_signature(rv) AS sig FROM reviewer rv) g
+    ON g.reviewer_id = r.reviewer_id
+WHERE g.sig IS NOT NULL
+GROUP BY g.sig, r.product_id;
+"""
+
+
+async def rebuild_reviewer_signature_ratings(conn):
+    await conn.execute(text("TRUNCATE reviewer_signature_rating"))
+    await conn.execute(text(REVIEWER_SIGNATURE_RATING_REBUILD_SQL))
+
+
+async def create_reviewer_signature_rating_triggers(conn):
+    await conn.execute(text(REVIEWER_SIGNATURE_FUNCTION_SQL))
+    await conn.execute(text(APPLY_SIGNATURE_RATING_FUNCTION_SQL))
+    await conn.execute(text(REVIEW_SIGNATURE_RATING_FUNCTION_SQL))
+    await conn.execute(text(REVIEWER_SIGNATURE_RATING_FUNCTION_SQL))
+    await conn.execute(
+        text("DROP TRIGGER IF EXISTS review_signature_rating_trigger ON review")
+    )
+    await conn.execute(
+        text(
+            """
+            CREATE TRIGGER review_signature_rating_trigger
+            AFTER INSERT OR DELETE OR UPDATE OF product_id, reviewer_id, rating, repurchase_intention
+            ON review
+            FOR EACH ROW
+            EXECUTE FUNCTION update_signature_rating_on_review();
+            """
+        )
+    )
+    await conn.execute(
+        text("DROP TRIGGER IF EXISTS reviewer_signature_rating_trigger ON reviewer")
+    )
+    await conn.execute(
+        text(
+            f"""
+            CREATE TRIGGER reviewer_signature_rating_trigger
+            AFTER UPDATE OF {", ".join(REVIEWER_SIGNATURE_ATTRIBUTES)}
+            ON reviewer
+            FOR EACH ROW
+            EXECUTE FUNCTION update_signature_rating_on_reviewer();
+            """
+        )
+    )
+    # 처음 생성된 경우 기존 리뷰로 채운다
+    empty = await conn.execute(
+        text("SELECT NOT EXISTS (SELECT 1 FROM reviewer_signature_rating)")
+    )
+    if empty.scalar():
+        await rebuild_reviewer_signature_ratings(conn)
+
+
+# reviewer_recommendation 갱신 필요 표시
+# 리뷰어 u 의 CF 점수는 u 와 유사도 2 이상인 시그니처의 리뷰에만 의존하므로,
+# 리뷰가 바뀌면 작성자 시그니처와 유사한 프로필의 행만 stale 로 표시한다.
+# 제품 속성/브랜드/리뷰 수 100 기준이 바뀌면 CBF 점수가 모두 바뀌므로 전체를 표시한다.
+# stale_at 은 마지막 변경 시각으로 갱신한다. 재계산은 그 시각 이후의 데이터로 계산한 경우에만 stale 을 지운다.
+PROFILE_SIMILAR_FUNCTION_SQL = """
+CREATE OR REPLACE FUNCTION profile_similar(profile int[], sig int[])
+RETURNS boolean AS $$
+    SELECT sig IS NOT NULL AND (
+        profile[1] * sig[1] + profile[2] * sig[2] + profile[3] * sig[3] +
+        profile[4] * sig[4] + profile[5] * sig[5] + profile[6] * sig[6]
+    ) >= 2;
+$$ LANGUAGE sql IMMUTABLE;
+"""
+
+MARK_RECOMMENDATIONS_STALE_FUNCTION_SQL = """
+CREATE OR REPLACE FUNCTION mark_recommendations_stale(reviewer_ids int[])
+RETURNS void AS $$
+    WITH sigs AS (
+        SELECT DISTINCT reviewer_signature(rv) AS sig
+        FROM reviewer rv
+        WHERE rv.reviewer_id = ANY(reviewer_ids)
+    )
+    UPDATE reviewer_recommendation rr
+    SET stale_at = now()
+    WHERE (rr.stale_at IS NULL OR rr.stale_at < now())
+      AND EXISTS (SELECT 1 FROM sigs WHERE profile_similar(rr.profile, sigs.sig));
+$$ LANGUAGE sql;
+"""
+
+REVIEW_RECOMMENDATION_STALE_FUNCTION_SQL = """
+CREATE OR REPLACE FUNCTION mark_recommendations_stale_on_review()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM mark_recommendations_stale(ARRAY(SELECT DISTINCT reviewer_id FROM new_rows));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM mark_recommendations_stale(ARRAY(SELECT DISTINCT reviewer_id FROM old_rows));
+    ELSE
+        PERFORM mark_recommendations_stale(ARRAY(
+            SELECT DISTINCT unnest(ARRAY[o.reviewer_id, n.reviewer_id])
+            FROM old_rows o JOIN new_rows n ON n.review_id = o.review_id
+            WHERE (o.product_id, o.reviewer_id, o.rating, o.repurchase_intention)
+                IS DISTINCT FROM (n.product_id, n.reviewer_id, n.rating, n.repurchase_intention)
+        ));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+REVIEWER_RECOMMENDATION_STALE_FUNCTION_SQL = """
+CREATE OR REPLACE FUNCTION mark_recommendations_stale_on_reviewer()
+RETURNS TRIGGER AS $$
+BEGIN
+    -- 본인의 프로필이 바뀜
+    UPDATE reviewer_recommendation SET stale_at = now()
+    WHERE reviewer_id = NEW.reviewer_id AND (stale_at IS NULL OR stale_at < now());
+    -- 이 리뷰어의 리뷰가 다른 시그니처로 옮겨짐
+    IF reviewer_signature(OLD) IS DISTINCT FROM reviewer_signature(NEW)
+       AND EXISTS (SELECT 1 FROM review WHERE reviewer_id = NEW.reviewer_id) THEN
+        UPDATE reviewer_recommendation rr SET stale_at = now()
+        WHERE (rr.stale_at IS NULL OR rr.stale_at < now())
+          AND (profile_similar(rr.profile, reviewer_signature(OLD))
+               OR profile_similar(rr.profile, reviewer_signature(NEW)));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+# CBF 점수에 쓰이는 제품 컬럼 (number_of_reviews 는 100 기준만 비교)
+PRODUCT_SCORE_COLUMNS = [
+    "brand_name",
+    "skin_type_oily",
+    "cleansing_power_very_satisfied",
+    "skin_concern_soothing",
+    "irritation_level_not_irritating",
+    "skin_type_combination",
+    "skin_concern_wrinkles_whitening",
+    "skin_type_dry",
+]
+
+PRODUCT_RECOMMENDATION_STALE_FUNCTION_SQL = f"""
+CREATE OR REPLACE FUNCTION mark_recommendations_stale_on_product()
+RETURNS TRIGGER AS $$
+BEGIN
+    -- old_rows 는 UPDATE 에서만 존재하므로 IF 를 중첩해 INSERT/DELETE 에서는 참조하지 않는다
+    IF TG_OP = 'UPDATE' THEN
+        IF NOT EXISTS (
+            SELECT 1
+            FROM old_rows o JOIN new_rows n ON n.product_id = o.product_id
+            WHERE ({", ".join("o." + c for c in PRODUCT_SCORE_COLUMNS)}, o.number_of_reviews >= 100)
+                IS DISTINCT FROM
+                  ({", ".join("n." + c for c in PRODUCT_SCORE_COLUMNS)}, n.number_of_reviews >= 100)
+        ) THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+    UPDATE reviewer_recommendation SET stale_at = now() WHERE stale_at IS NULL OR stale_at < now();
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+async def create_recommendation_stale_triggers(conn):
+    await conn.execute(text(PROFILE_SIMILAR_FUNCTION_SQL))
+    await conn.execute(text(MARK_RECOMMENDATIONS_STALE_FUNCTION_SQL))
+    await conn.execute(text(REVIEW_RECOMMENDATION_STALE_FUNCTION_SQL))
+    await conn.execute(text(REVIEWER_RECOMMENDATION_STALE_FUNCTION_SQL))
+    await conn.execute(text(PRODUCT_RECOMMENDATION_STALE_FUNCTION_SQL))
+
+    # 전이 테이블을 쓰는 문장 단위 트리거는 이벤트마다 따로 만든다
+    for table, event, referencing in [
+        ("review", "INSERT", "NEW TABLE AS new_rows"),
+        ("review", "DELETE", "OLD TABLE AS old_rows"),
+        ("review", "UPDATE", "OLD TABLE AS old_rows NEW TABLE AS new_rows"),
+        ("product", "INSERT", "NEW TABLE AS new_rows"),
+        ("product", "DELETE", "OLD TABLE AS old_rows"),
+        ("product", "UPDATE", "OLD TABLE AS old_rows NEW TABLE AS new_rows"),
+    ]:
+        name = f"{table}_{event.lower()}_recommendation_stale_trigger"
+        await conn.execute(text(f"DROP TRIGGER IF EXISTS {name} ON {table}"))
+        await conn.execute(
+            text(
+                f"""
+                CREATE TRIGGER {name}
+                AFTER {event} ON {table}
+                REFERENCING {referencing}
+                FOR EACH STATEMENT
+                EXECUTE FUNCTION mark_recommendations_stale_on_{table}();
+                """
+            )
+        )
+
+    await conn.execute(
+        text("DROP TRIGGER IF EXISTS reviewer_recommendation_stale_trigger ON reviewer")
+    )
+    await conn.execute(
+        text(
+            f"""
+            CREATE TRIGGER reviewer_recommendation_stale_trigger
+            AFTER UPDATE OF {", ".join(REVIEWER_SIGNATURE_ATTRIBUTES)}
+            ON reviewer
+            FOR EACH ROW
+            EXECUTE FUNCTION mark_recommendations_stale_on_reviewer();
+            """
+        )
+    )
+
+
+# 결과 캐시 무효화용 데이터 버전. 쓰기 문장마다 시퀀스를 올린다.
+DATA_VERSION_FUNCTION_SQL = """
+CREATE OR REPLACE FUNCTION bump_data_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM nextval('data_version');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+DATA_VERSION_TABLES = ["review", "product", "reviewer"]
+
+
+async def create_data_version_triggers(conn):
+    await conn.execute(text("CREATE SEQUENCE IF NOT EXISTS data_version"))
+    await conn.execute(text(DATA_VERSION_FUNCTION_SQL))
+    for table in DATA_VERSION_TABLES:
+        await conn.execute(
+            text(f"DROP TRIGGER IF EXISTS {table}_data_version_trigger ON {table}")
+        )
+        await conn.execute(
+            text(
+                f"""
+                CREATE TRIGGER {table}_data_version_trigger
+                AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+                FOR EACH STATEMENT
+                EXECUTE FUNCTION bump_data_version();
+                """
+            )
+        )
+
+
+# 제품 리뷰 통계 (number_of_reviews, review_rating, review_N_star_ratio)
+# product_review_stats 의 합계/개수를 증분으로 갱신하고 그 값으로 제품 컬럼을 다시 계산한다.
+#   row       : 리뷰 한 건마다 실행 (INSERT / DELETE / product_id, rating UPDATE)
+#   statement : 전이 테이블로 문장 단위 실행. 대량 적재 시 제품당 한 번만 갱신
+REVIEW_STATS_TRIGGER_MODE = os.getenv("REVIEW_STATS_TRIGGER_MODE", "row")
+STARS = range(1, 6)
+
+APPLY_PRODUCT_REVIEW_STATS_FUNCTION_SQL = f"""
+CREATE OR REPLACE FUNCTION apply_product_review_stats(
+    target_product_id int, reviews int, rating_sum bigint, rated int,
+    {", ".join(f"star_{n} int" for n in STARS)}
+)
+RETURNS void AS $$
+BEGIN
+    INSERT INTO product_review_stats AS s (
+        product_id, rating_sum, rating_count, {", ".join(f"star_{n}_count" for n in STARS)}
+    )
+    VALUES (target_product_id, rating_sum, rated, {", ".join(f"star_{n}" for n in STARS)})
+    ON CONFLICT (product_id) DO UPDATE
+    SET rating_sum = s.rating_sum + EXCLUDED.rating_sum,
+        rating_count = s.rating_count + EXCLUDED.rating_count,
+        {", ".join(f"star_{n}_count = s.star_{n}_count + EXCLUDED.star_{n}_count" for n in STARS)};
+
+    -- 통계가 바뀐 제품만 다시 계산한다. 리뷰가 바뀌지 않은 제품은 적재/수정된 값을 그대로 둔다.
+    UPDATE product p
+    SET number_of_reviews = COALESCE(p.number_of_reviews, 0) + reviews,
+        review_rating = CEIL(s.rating_sum::numeric / NULLIF(s.rating_count, 0)),
+        {", ".join(f"review_{n}_star_ratio = 100.0 * s.star_{n}_count / NULLIF(s.rating_count, 0)" for n in STARS)}
+    FROM product_review_stats s
+    WHERE p.product_id = target_product_id AND s.product_id = target_product_id;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def _review_stats_args(row: str, sign: str) -> str:
+    return ", ".join(
+        [
+            f"{row}.product_id",
+            f"{sign}1",
+            f"{sign}COALESCE({row}.rating, 0)",
+            f"{sign}({row}.rating IS NOT NULL)::int",
+        ]
+        + [f"{sign}({row}.rating IS NOT DISTINCT FROM {n})::int" for n in STARS]
+    )
+
+
+PRODUCT_REVIEW_STATS_FUNCTION_SQL = f"""
+CREATE OR REPLACE FUNCTION update_product_review_stats()
+RETURNS TRIGGER AS $$
+BEGIN
+    -- 제품과 평점이 그대로인 UPDATE 는 통계를 바꾸지 않는다
+    IF TG_OP = 'UPDATE' AND OLD.product_id = NEW.product_id
+        AND OLD.rating IS NOT DISTINCT FROM NEW.rating THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM apply_product_review_stats({_review_stats_args("OLD", "-")});
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM apply_product_review_stats({_review_stats_args("NEW", "")});
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+# 변경된 리뷰 행들(sign = +1 / -1)을 제품별 증분으로 합친다
+REVIEW_STATS_DELTA_COLUMNS = {
+    "reviews": "SUM(sign)::int",
+    "rating_sum": "COALESCE(SUM(sign * rating), 0)::bigint",
+    "rated": "SUM(sign * (rating IS NOT NULL)::int)::int",
+    **{f"star_{n}": f"SUM(sign * (rating IS NOT DISTINCT FROM {n})::int)::int" for n in STARS},
+}
+
+
+def _review_stats_delta_sql(changes: str) -> str:
+    deltas = REVIEW_STATS_DELTA_COLUMNS
+    return f"""PERFORM apply_product_review_stats(d.product_id, {", ".join("d." + name for name in deltas)})
+        FROM (
+            SELECT product_id, {", ".join(f"{expr} AS {name}" for name, expr in deltas.items())}
+            FROM ({changes}) changes
+            GROUP BY product_id
+            HAVING ({", ".join(deltas.values())})
+                IS DISTINCT FROM ({", ".join(["0"] * len(deltas))})
+        ) d;"""
+
+
+PRODUCT_REVIEW_STATS_BATCH_FUNCTION_SQL = f"""
+CREATE OR REPLACE FUNCTION update_product_review_stats_batch()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        {_review_stats_delta_sql(
+            "SELECT product_id, rating, 1 AS sign FROM new_rows"
+        )}
+    ELSIF TG_OP = 'DELETE' THEN
+        {_review_stats_delta_sql(
+            "SELECT product_id, rating, -1 AS sign FROM old_rows"
+        )}
+    ELSE
+        {_review_stats_delta_sql(
+            "SELECT product_id, rating, 1 AS sign FROM new_rows "
+            "UNION ALL SELECT product_id, rating, -1 AS sign FROM old_rows"
+        )}
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+PRODUCT_REVIEW_STATS_REBUILD_SQL = f"""
+INSERT INTO product_review_stats (
+    product_id, rating_sum, rating_count, {", ".join(f"star_{n}_count" for n in STARS)}
+)
+SELECT
+    product_id,
+    COALESCE(SUM(rating), 0),
+    COUNT(rating),
+    {", ".join(f"COUNT(*) FILTER (WHERE rating = {n})" for n in STARS)}
+FROM review
+GROUP BY product_id;
+"""
+
+REVIEW_STATS_TRIGGERS = [
+    "review_insert_trigger",
+    "review_stats_trigger",
+    "review_stats_insert_trigger",
+    "review_stats_delete_trigger",
+    "review_stats_update_trigger",
+]
+
+
+async def rebuild_product_review_stats(conn):
+    await conn.execute(text("TRUNCATE product_review_stats"))
+    await conn.execute(text(PRODUCT_REVIEW_STATS_REBUILD_SQL))
+
+
+async def create_product_review_stats_triggers(conn, mode: str = REVIEW_STATS_TRIGGER_MODE):
+    await conn.execute(text(APPLY_PRODUCT_REVIEW_STATS_FUNCTION_SQL))
+    await conn.execute(text(PRODUCT_REVIEW_STATS_FUNCTION_SQL))
+    await conn.execute(text(PRODUCT_REVIEW_STATS_BATCH_FUNCTION_SQL))
+    for name in REVIEW_STATS_TRIGGERS:
+        await conn.execute(text(f"DROP TRIGGER IF EXISTS {name} ON review"))
+    # 제품 행을 쓸 때마다 파생 컬럼을 덮어쓰던 이전 트리거 제거
+    await conn.execute(text("DROP TRIGGER IF EXISTS product_review_stats_sync_trigger ON product"))
+    await conn.execute(text("DROP FUNCTION IF EXISTS sync_product_review_stats()"))
+
+    if mode == "row":
+        await conn.execute(
+            text(
+                """
+                CREATE TRIGGER review_stats_trigger
+                AFTER INSERT OR DELETE OR UPDATE OF product_id, rating
+                ON review
+                FOR EACH ROW
+                EXECUTE FUNCTION update_product_review_stats();
+                """
+            )
+        )
+    elif mode == "statement":
+        for event, referencing in [
+            ("INSERT", "NEW TABLE AS new_rows"),
+            ("DELETE", "OLD TABLE AS old_rows"),
+            ("UPDATE", "OLD TABLE AS old_rows NEW TABLE AS new_rows"),
+        ]:
+            await conn.execute(
+                text(
+                    f"""
+                    CREATE TRIGGER review_stats_{event.lower()}_trigger
+                    AFTER {event} ON review
+                    REFERENCING {referencing}
+                    FOR EACH STATEMENT
+                    EXECUTE FUNCTION update_product_review_stats_batch();
+                    """
+                )
+            )
+    else:
+        raise ValueError(f"Unknown review stats trigger mode: {mode}")
+
+    # 처음 생성된 경우 기존 리뷰로 채운다 (제품 컬럼은 해당 제품의 리뷰가 바뀔 때 갱신)
+    empty = await conn.execute(
+        text("SELECT NOT EXISTS (SELECT 1 FROM product_review_stats)")
+    )
+    if empty.scalar():
+        await rebuild_product_review_stats(conn)
@@ -1,17 +1,57 @@
-from sqlalchemy import Column, Integer, String, Boolean, Float, Text, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, Float, Text, ForeignKey, DateTime, Numeric, func
 from sqlalchemy.orm import relationship, backref
 from .database import Base
-from sqlalchemy.types import UserDefinedType
+from sqlalchemy.types import UserDefinedType, ARRAY
+import numpy as np
+import struct
+
+EMBEDDING_DIM = 768
+
+
+# pgvector 바이너리 포맷: dim(uint16), unused(uint16), float4 * dim (network byte order)
+def encode_vector(value) -> bytes:
+    array = np.asarray(value, dtype=">f4")
+    return struct.pack(">HH", array.shape[0], 0) + array.tobytes()
+
+
+def decode_vector(data: bytes) -> np.ndarray:
+    dim, _ = struct.unpack_from(">HH", data)
+    return np.frombuffer(data, dtype=">f4", count=dim, offset=4).astype(np.float32)
+
 
 class Vector(UserDefinedType):
-    def get_col_spec(self):
-        return "vector(768)"
-    
-    def bind_expression(self, bindvalue):
-        return bindvalue
+    """pgvector 컬럼. asyncpg 바이너리 코덱(database.py)을 통해 float32 ndarray 로 주고받는다."""
+
+    cache_ok = True
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+
+    def get_col_spec(self, **kw):
+        return f"vector({self.dim})"
+
+    def bind_processor(self, dialect):
+        def process(value):
+            if value is None:
+                return None
+            return np.asarray(value, dtype=np.float32)
+
+        return process
+
+    def result_processor(self, dialect, coltype):
+        def process(value):
+            if value is None or isinstance(value, np.ndarray):
+                return value
+            # 코덱이 등록되지 않은 연결에서는 텍스트('[1,2,...]')로 들어온다
+            return np.fromstring(value.strip("[]"), sep=",", dtype=np.float32)
+
+        return process
+
+    def compare_values(self, x, y):
+        if x is None or y is None:
+            return x is y
+        return np.array_equal(x, y)
 
-    def column_expression(self, col):
-        return col
 
 class Reviewer(Base):
     __tablename__ = "reviewer"
@@ -103,3 +143,88 @@ class Review(Base):
     review_content = Column(Text, nullable=True)
     review_date = Column(DateTime, nullable=True)
     review_content_embedding = Column(Vector, nullable=True) 
+
+
+class QueryEmbedding(Base):
+    __tablename__ = "query_embedding_cache"
+    query_text = Column(Text, primary_key=True)
+    embedding = Column(Vector, nullable=False)
+    last_used_at = Column(DateTime, nullable=False, server_default=func.now())
+
+
+class ProductReviewCentroid(Base):
+    # review 트리거가 유지. 정규화된 리뷰 임베딩의 합(평균 = 합 / 개수)
+    __tablename__ = "product_review_centroid"
+    product_id = Column(
+        Integer, ForeignKey("product.product_id", ondelete="CASCADE"), primary_key=True
+    )
+    review_count = Column(Integer, nullable=False, default=0)
+    used_count = Column(Integer, nullable=False, default=0)
+    embedding_count = Column(Integer, nullable=False, default=0)
+    used_embedding_count = Column(Integer, nullable=False, default=0)
+    embedding_sum = Column(Vector, nullable=False)
+    used_embedding_sum = Column(Vector, nullable=False)
+
+
+class ProductReviewStats(Base):
+    # review 트리거가 유지하는 제품별 평점 합계/개수와 별점별 개수
+    __tablename__ = "product_review_stats"
+    product_id = Column(
+        Integer, ForeignKey("product.product_id", ondelete="CASCADE"), primary_key=True
+    )
+    rating_sum = Column(BigInteger, nullable=False, default=0)
+    rating_count = Column(Integer, nullable=False, default=0)
+    star_1_count = Column(Integer, nullable=False, default=0)
+    star_2_count = Column(Integer, nullable=False, default=0)
+    star_3_count = Column(Integer, nullable=False, default=0)
+    star_4_count = Column(Integer, nullable=False, default=0)
+    star_5_count = Column(Integer, nullable=False, default=0)
+
+
+class ReviewerSignatureRating(Base):
+    # review/reviewer 트리거가 유지. 피부 속성 그룹 합(시그니처) x 제품별 가중 평점 합과 리뷰 수
+    __tablename__ = "reviewer_signature_rating"
+    sig_oily = Column(Integer, primary_key=True)
+    sig_excess_sebum = Column(Integer, primary_key=True)
+    sig_trouble = Column(Integer, primary_key=True)
+    sig_combination = Column(Integer, primary_key=True)
+    sig_whitening_wrinkles = Column(Integer, primary_key=True)
+    sig_dry = Column(Integer, primary_key=True)
+    product_id = Column(
+        Integer, ForeignKey("product.product_id", ondelete="CASCADE"), primary_key=True
+    )
+    weighted_rating_sum = Column(Numeric, nullable=False, default=0)
+    rated_count = Column(Integer, nullable=False, default=0)
+    review_count = Column(Integer, nullable=False, default=0)
+
+
+class ReviewerRecommendation(Base):
+    # reviewer_recommendation 배치 작업이 채우는 리뷰어별 recsys2 상위 N개 (순위 순서)
+    __tablename__ = "reviewer_recommendation"
+    reviewer_id = Column(
+        Integer, ForeignKey("reviewer.reviewer_id", ondelete="CASCADE"), primary_key=True
+    )
+    # 계산에 사용한 프로필 그룹 값 (트리거가 영향받는 리뷰어를 찾을 때 사용)
+    profile = Column(ARRAY(Integer), nullable=False)
+    product_ids = Column(ARRAY(Integer), nullable=False)
+    final_scores = Column(ARRAY(Float), nullable=False)
+    computed_at = Column(DateTime(timezone=True), nullable=False)
+    # NULL 이면 최신. 결과에 영향을 주는 변경이 생긴 시각
+    stale_at = Column(DateTime(timezone=True), nullable=True, index=True)
+
+
+class UploadCheckpoint(Base):
+    # csv_upload --embed 가 청크를 커밋할 때마다 함께 갱신하는 진행 위치 (중단 후 이어서 적재)
+    __tablename__ = "upload_checkpoint"
+    table_name = Column(String(63), primary_key=True)
+    csv_path = Column(Text, primary_key=True)
+    rows_done = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+
+class SyncRowHash(Base):
+    # csv_upload --mode sync 가 기록하는 마지막 동기화 때의 CSV 행 해시 (다음 동기화에서 바뀐 행만 반영)
+    __tablename__ = "sync_row_hash"
+    table_name = Column(String(63), primary_key=True)
+    row_id = Column(Integer, primary_key=True)
+    row_hash = Column(String(32), nullable=False)
@@ -1,3 +1,5 @@
+import os
+import time
 import psycopg2
 import numpy as np
 import pandas as pd
@@ -7,36 +9,62 @@ from .models import Product
 from typing import Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
-from sentence_transformers import SentenceTransformer
+from .cache import query_embedding_cache, result_cache, normalize_query
+from .vector_index import vector_index
+from .score_engine import score_engine
 
-# 모델 초기화
-model = SentenceTransformer('bespin-global/klue-sroberta-base-continue-learning-by-mnr')
+# 추천에 사용하는 사용자 프로필 항목
+USER_VECTOR_FIELDS = [
+    'skin_type_oily',
+    'skin_concern_excess_sebum',
+    'skin_type_trouble_prone',
+    'skin_type_sensitive',
+    'skin_concern_trouble',
+    'skin_concern_atopy',
+    'skin_type_combination',
+    'skin_type_normal',
+    'skin_concern_whitening',
+    'skin_concern_wrinkles',
+    'skin_type_dry',
+    'skin_type_mildly_dry',
+]
 
-# 최종 스코어 계산 함수
-async def calculate_final_scores(db: AsyncSession, user_vector):
-    # user_vector를 SQL 쿼리에 맞게 변환
-    user_vector_query = f"""
-    WITH user_vector AS (
+# user_vector CTE. 고정된 SQL 에 프로필 값은 바인드 파라미터로 전달한다.
+USER_VECTOR_CTE = """
+    user_vector AS (
         SELECT
-            {user_vector['reviewer_id']} AS reviewer_id,
-            {user_vector['skin_type_oily']}::boolean AS skin_type_oily,
-            {user_vector['skin_concern_excess_sebum']}::boolean AS skin_concern_excess_sebum,
-            {user_vector['skin_type_trouble_prone']}::boolean AS skin_type_trouble_prone,
-            {user_vector['skin_type_sensitive']}::boolean AS skin_type_sensitive,
-            {user_vector['skin_concern_trouble']}::boolean AS skin_concern_trouble,
-            {user_vector['skin_concern_atopy']}::boolean AS skin_concern_atopy,
-            {user_vector['skin_type_combination']}::boolean AS skin_type_combination,
-            {user_vector['skin_type_normal']}::boolean AS skin_type_normal,
-            {user_vector['skin_concern_whitening']}::boolean AS skin_concern_whitening,
-            {user_vector['skin_concern_wrinkles']}::boolean AS skin_concern_wrinkles,
-            {user_vector['skin_type_dry']}::boolean AS skin_type_dry,
-            {user_vector['skin_type_mildly_dry']}::boolean AS skin_type_mildly_dry
+            CAST(:reviewer_id AS integer) AS reviewer_id,
+            CAST(:skin_type_oily AS boolean) AS skin_type_oily,
+            CAST(:skin_concern_excess_sebum AS boolean) AS skin_concern_excess_sebum,
+            CAST(:skin_type_trouble_prone AS boolean) AS skin_type_trouble_prone,
+            CAST(:skin_type_sensitive AS boolean) AS skin_type_sensitive,
+            CAST(:skin_concern_trouble AS boolean) AS skin_concern_trouble,
+            CAST(:skin_concern_atopy AS boolean) AS skin_concern_atopy,
+            CAST(:skin_type_combination AS boolean) AS skin_type_combination,
+            CAST(:skin_type_normal AS boolean) AS skin_type_normal,
+            CAST(:skin_concern_whitening AS boolean) AS skin_concern_whitening,
+            CAST(:skin_concern_wrinkles AS boolean) AS skin_concern_wrinkles,
+            CAST(:skin_type_dry AS boolean) AS skin_type_dry,
+            CAST(:skin_type_mildly_dry AS boolean) AS skin_type_mildly_dry
     )
-    """
-    # print(user_vector_query)
-    # 전체 SQL 쿼리
-    query = f"""
-    {user_vector_query},
+"""
+
+def to_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', 't', '1', 'yes')
+    return bool(value)
+
+def user_vector_params(user_vector):
+    params = {field: to_bool(user_vector[field]) for field in USER_VECTOR_FIELDS}
+    params['reviewer_id'] = int(user_vector.get('reviewer_id', -1))
+    return params
+
+def profile_bitmask(params):
+    # 12개 프로필 값을 하나의 정수로 (결과 캐시 키). reviewer_id 는 점수에 영향이 없다.
+    return sum(1 << i for i, field in enumerate(USER_VECTOR_FIELDS) if params[field])
+
+# CBF/CF 점수 계산 CTE. user_vector CTE 뒤에 이어 붙여서 사용한다.
+CBF_CF_SCORES_CTE = """
     global_mean AS (
         SELECT
             AVG((
@@ -76,41 +104,29 @@ async def calculate_final_scores(db: AsyncSession, user_vector):
             (raw_score - AVG(raw_score) OVER ()) / STDDEV(raw_score) OVER () AS z_score
         FROM product_scores
     ),
-    similar_users AS (
+    similar_signatures AS (
+        -- reviewer_signature_rating: 같은 피부 속성 시그니처의 리뷰어를 제품별로 미리 합산한 테이블
         SELECT
-            r.reviewer_id,
-            (r.skin_type_oily::int * u.skin_type_oily::int +
-             r.skin_concern_excess_sebum::int * u.skin_concern_excess_sebum::int +
-             (r.skin_type_trouble_prone::int + r.skin_type_sensitive::int + 
-              r.skin_concern_trouble::int + r.skin_concern_atopy::int) * 
-              (u.skin_type_trouble_prone::int + u.skin_type_sensitive::int + 
-               u.skin_concern_trouble::int + u.skin_concern_atopy::int) +
-             (r.skin_type_combination::int + r.skin_type_normal::int) * 
-              (u.skin_type_combination::int + u.skin_type_normal::int) +
-             (r.skin_concern_whitening::int + r.skin_concern_wrinkles::int) * 
-              (u.skin_concern_whitening::int + u.skin_concern_wrinkles::int) +
-             (r.skin_type_dry::int + r.skin_type_mildly_dry::int) * 
-              (u.skin_type_dry::int + u.skin_type_mildly_dry::int)
-            ) AS similarity
-        FROM reviewer r, user_vector u
-    ),
-    filtered_users AS (
-        SELECT reviewer_id
-        FROM similar_users
-        WHERE similarity >= 2
-    ),
-    similar_reviews AS (
-        SELECT
-            product_id,
-            (r.rating * (CASE WHEN r.repurchase_intention THEN 1.5 ELSE 1 END)) AS weighted_rating
-        FROM review r
-        WHERE r.reviewer_id IN (SELECT reviewer_id FROM filtered_users)
+            s.product_id,
+            s.weighted_rating_sum,
+            s.rated_count,
+            s.review_count
+        FROM reviewer_signature_rating s, user_vector u
+        WHERE (s.sig_oily * u.skin_type_oily::int +
+               s.sig_excess_sebum * u.skin_concern_excess_sebum::int +
+               s.sig_trouble *
+                (u.skin_type_trouble_prone::int + u.skin_type_sensitive::int + 
+                 u.skin_concern_trouble::int + u.skin_concern_atopy::int) +
+               s.sig_combination * (u.skin_type_combination::int + u.skin_type_normal::int) +
+               s.sig_whitening_wrinkles * (u.skin_concern_whitening::int + u.skin_concern_wrinkles::int) +
+               s.sig_dry * (u.skin_type_dry::int + u.skin_type_mildly_dry::int)
+              ) >= 2
     ),
     average_ratings AS (
         SELECT
             product_id,
-            SUM(weighted_rating) / COUNT(*) AS avg_rating
-        FROM similar_reviews
+            CASE WHEN SUM(rated_count) > 0 THEN SUM(weighted_rating_sum) / SUM(review_count) END AS avg_rating
+        FROM similar_signatures
         GROUP BY product_id
     ),
     z_scores_similar_users AS (
@@ -133,7 +149,7 @@ async def calculate_final_scores(db: AsyncSession, user_vector):
             (avg_brand_score - AVG(avg_brand_score) OVER ()) / STDDEV(avg_brand_score) OVER () AS z_score
         FROM brand_scores
     ),
-    final_scores AS (
+    recommendation_scores AS (
         SELECT
             p.product_id,
             p.product_name,
@@ -148,89 +164,354 @@ async def calculate_final_scores(db: AsyncSession, user_vector):
         LEFT JOIN z_scores_similar_users zs ON p.product_id = zs.product_id
         LEFT JOIN z_scores_brand zb ON p.brand_name = zb.brand_name
         WHERE 0.2 * zp.z_score + 0.7 * zs.z_score + 0.1 * zb.z_score >= 0
-        ORDER BY final_score DESC
+        ORDER BY final_score DESC, product_id
     )
-    SELECT * FROM final_scores;
-    """
-    # 쿼리 실행
-    result = await execute_custom_query(db, text(query))
-    return result
+"""
 
-async def get_top_products_by_similarity(db: AsyncSession, query: str, alpha=1.0, beta=1.0, gamma=1.5, top_n=None):
-    # 쿼리를 임베딩 벡터로 변환
-    query_embedding = model.encode([query])[0].tolist()
+# 전체 SQL 쿼리 (요청마다 같은 문장이므로 연결별 prepared statement 캐시가 재사용된다)
+FINAL_SCORES_QUERY = f"""
+WITH {USER_VECTOR_CTE},
+{CBF_CF_SCORES_CTE}
+SELECT * FROM recommendation_scores ORDER BY final_score DESC, product_id;
+"""
 
-    # product_similarities 테이블이 존재하면 삭제
-    await db.execute(text("DROP TABLE IF EXISTS product_similarities"))
-    
-    # 제품명 임베딩과의 유사도 계산
-    product_name_similarities_query = """
-    CREATE TABLE product_similarities AS
-    WITH query_embedding AS (
-        SELECT '%s'::vector AS embedding
-    ),
-    product_similarities AS (
-        SELECT
-            p.product_id,
-            p.product_name,
-            1 - (p.product_name_embedding <=> (SELECT embedding FROM query_embedding)) AS name_similarity
-        FROM
-            product p
+# 점수 계산 백엔드: sql (CTE 쿼리) | numpy (score_engine 의 인메모리 배열)
+SCORING_BACKENDS = ("sql", "numpy")
+
+# 최종 스코어 계산 함수
+async def calculate_final_scores(db: AsyncSession, user_vector, scoring="sql"):
+    params = user_vector_params(user_vector)
+
+    async def compute():
+        if scoring == "numpy":
+            return score_engine.score(params)
+        # 쿼리 실행
+        return await execute_custom_query(db, text(FINAL_SCORES_QUERY), params)
+
+    # numpy 결과는 엔진 스냅샷에 따라 달라지므로, 먼저 스냅샷을 갱신하고 그 시각을 키에 넣는다
+    # (data_version 이 바뀐 뒤 오래된 스냅샷으로 계산한 결과가 새 스냅샷 이후까지 남지 않도록)
+    snapshot = None
+    if scoring == "numpy":
+        await score_engine.refresh(db)
+        snapshot = score_engine.loaded_at
+    return await result_cache.get_or_compute(db, ("final_scores", profile_bitmask(params), scoring, snapshot), compute)
+
+# 리뷰 유사도 집계: 리뷰 전체를 스캔하는 방식
+REVIEW_SCAN_AGGREGATES_SQL = """
+review_similarities AS (
+    SELECT
+        r.product_id,
+        1 - (r.review_content_embedding <=> q.embedding) AS review_similarity,
+        r.used_over_one_month
+    FROM
+        review r, params q
+    {review_filter}
+),
+product_review_aggregates AS (
+    SELECT
+        rs.product_id,
+        COUNT(*) AS review_count,
+        SUM(CASE WHEN rs.used_over_one_month = True THEN 1 ELSE 0 END) AS used_count,
+        AVG(rs.review_similarity) AS avg_similarity,
+        AVG(CASE WHEN rs.used_over_one_month = True THEN rs.review_similarity ELSE NULL END) AS avg_similarity_used
+    FROM
+        review_similarities rs
+    GROUP BY
+        rs.product_id
+)"""
+
+# 리뷰 유사도 집계: product_review_centroid 로 제품당 한 행만 읽는 방식
+# AVG(1 - (r <=> q)) = (정규화 리뷰 임베딩 합 · 정규화 q) / 개수
+CENTROID_AGGREGATES_SQL = """
+product_review_aggregates AS (
+    SELECT
+        c.product_id,
+        c.review_count,
+        c.used_count,
+        -(c.embedding_sum <#> q.embedding_normalized) / NULLIF(c.embedding_count, 0) AS avg_similarity,
+        -(c.used_embedding_sum <#> q.embedding_normalized) / NULLIF(c.used_embedding_count, 0) AS avg_similarity_used
+    FROM
+        product_review_centroid c, params q
+    WHERE c.review_count > 0
+    {centroid_filter}
+)"""
+
+# 제품명 유사도와 리뷰 유사도를 한 번에 계산하는 읽기 전용 쿼리 (DDL 없음, WITH 절 없이 반환)
+# candidates_sql 이 주어지면 해당 제품들에 대해서만 정확한 점수를 계산한다.
+def build_semantic_scores_cte(candidates_sql=None, use_centroids=True):
+    candidates_cte = ""
+    product_filter = ""
+    review_filter = ""
+    centroid_filter = ""
+    if candidates_sql:
+        candidates_cte = f"""
+candidates AS (
+{candidates_sql}
+),"""
+        product_filter = "WHERE p.product_id IN (SELECT product_id FROM candidates)"
+        review_filter = "WHERE r.product_id IN (SELECT product_id FROM candidates)"
+        centroid_filter = "AND c.product_id IN (SELECT product_id FROM candidates)"
+    if use_centroids:
+        aggregates = CENTROID_AGGREGATES_SQL.format(centroid_filter=centroid_filter)
+    else:
+        aggregates = REVIEW_SCAN_AGGREGATES_SQL.format(review_filter=review_filter)
+    return f"""
+params AS (
+    SELECT
+        CAST(:query_embedding AS vector) AS embedding,
+        l2_normalize(CAST(:query_embedding AS vector)) AS embedding_normalized,
+        CAST(:alpha AS float8) AS alpha,
+        CAST(:beta AS float8) AS beta,
+        CAST(:gamma AS float8) AS gamma
+),{candidates_cte}
+product_similarities AS (
+    SELECT
+        p.product_id,
+        p.product_name,
+        1 - (p.product_name_embedding <=> q.embedding) AS name_similarity
+    FROM
+        product p, params q
+    {product_filter}
+),
+{aggregates},
+final_scores AS (
+    SELECT
+        pr.product_id,
+        ps.name_similarity,
+        pr.review_count,
+        pr.used_count,
+        pr.avg_similarity,
+        COALESCE(pr.avg_similarity_used, 0) AS avg_similarity_used,
+        CASE
+            WHEN pr.review_count >= 3 THEN
+                (ps.name_similarity * q.alpha + pr.avg_similarity * q.beta + COALESCE(pr.avg_similarity_used * q.gamma, 0)) / (1 + q.gamma + COALESCE(pr.used_count * q.gamma, 0))
+            ELSE
+                (ps.name_similarity * q.alpha + pr.avg_similarity * q.beta) / (1 + q.alpha + q.beta)
+        END AS final_score
+    FROM
+        product_review_aggregates pr
+        JOIN product_similarities ps ON pr.product_id = ps.product_id
+        CROSS JOIN params q
+)
+"""
+
+# ANN 인덱스(HNSW/IVFFlat)로 제품명/리뷰 최근접 후보를 뽑는다.
+# ORDER BY 에 바인드 파라미터를 직접 써야 인덱스 스캔이 선택된다.
+# product_filter 가 있으면 그 조건을 만족하는 제품 안에서만 최근접 후보를 찾는다
+# (인덱스 스캔 뒤에 걸러지므로 ef_search 가 작으면 후보가 ann_candidates 보다 적을 수 있다).
+def ann_candidates_sql(product_filter: str = None) -> str:
+    product_where = f"WHERE {product_filter}" if product_filter else ""
+    review_join = (
+        f"JOIN product p ON p.product_id = r.product_id WHERE {product_filter}" if product_filter else ""
     )
-    SELECT * FROM product_similarities;
-    """ %(query_embedding)
-    await db.execute(text(product_name_similarities_query))
-    await db.commit()
-
-    result = await db.execute(text("SELECT * FROM product_similarities"))
-    product_name_similarities = result.fetchall()
-
-    # 리뷰 임베딩과의 유사도 계산 및 제품별 평균 유사도 계산
-    review_similarities_query = """
-    WITH query_embedding AS (
-        SELECT '%s'::vector AS embedding
-    ),
-    review_similarities AS (
-        SELECT
-            r.product_id,
-            1 - (r.review_content_embedding <=> (SELECT embedding FROM query_embedding)) AS review_similarity,
-            r.used_over_one_month
-        FROM
-            review r
-    ),
-    product_review_aggregates AS (
-        SELECT
-            rs.product_id,
-            COUNT(*) AS review_count,
-            SUM(CASE WHEN rs.used_over_one_month = True THEN 1 ELSE 0 END) AS used_count,
-            AVG(rs.review_similarity) AS avg_similarity,
-            AVG(CASE WHEN rs.used_over_one_month = True THEN rs.review_similarity ELSE NULL END) AS avg_similarity_used
-        FROM
-            review_similarities rs
-        GROUP BY
-            rs.product_id
-    ),
-    final_scores AS (
-        SELECT
-            pr.product_id,
-            ps.name_similarity,
-            pr.review_count,
-            pr.used_count,
-            pr.avg_similarity,
-            COALESCE(pr.avg_similarity_used, 0) AS avg_similarity_used,
-            CASE
-                WHEN pr.review_count >= 3 THEN
-                    (ps.name_similarity * %s + pr.avg_similarity * %s + COALESCE(pr.avg_similarity_used * %s, 0)) / (1 + %s + COALESCE(pr.used_count * %s, 0))
-                ELSE
-                    (ps.name_similarity * %s + pr.avg_similarity * %s) / (1 + %s)
-            END AS final_score
-        FROM
-            product_review_aggregates pr
-            JOIN product_similarities ps ON pr.product_id = ps.product_id
+    return f"""
+    (
+        SELECT p.product_id FROM product p {product_where}
+        ORDER BY p.product_name_embedding <=> CAST(:query_embedding AS vector)
+        LIMIT :ann_candidates
+    )
+    UNION
+    (
+        SELECT nearest.product_id FROM (
+            SELECT r.product_id FROM review r {review_join}
+            ORDER BY r.review_content_embedding <=> CAST(:query_embedding AS vector)
+            LIMIT :ann_candidates
+        ) nearest
+    )"""
+
+ANN_CANDIDATES_SQL = ann_candidates_sql()
+
+# exact: centroid 기반 정확한 점수, scan: 리뷰 전체 스캔, ann: 인덱스 후보 + centroid 점수,
+# memory: 인프로세스 NumPy 인덱스 (스냅샷이 없으면 exact 로 대체)
+SEARCH_MODES = ("exact", "scan", "ann", "memory")
+ANN_CANDIDATES = int(os.getenv("ANN_CANDIDATES", "200"))
+# pgvector 의 hnsw.ef_search 최대값. HNSW 스캔은 ef_search 개까지만 반환하므로
+# ann_candidates 보다 작으면 후보가 잘린다.
+HNSW_EF_SEARCH_MAX = 1000
+
+# 후보 제품 ID 를 배열 파라미터로 받는 경우 (ANN 은 후보 안에서 최근접 검색)
+CANDIDATE_IDS_SQL = """
+    SELECT unnest(CAST(:candidate_ids AS integer[])) AS product_id"""
+CANDIDATE_IDS_FILTER = "p.product_id = ANY(CAST(:candidate_ids AS integer[]))"
+
+SEMANTIC_SCORES_CTE = {
+    "exact": build_semantic_scores_cte(),
+    "scan": build_semantic_scores_cte(use_centroids=False),
+    "ann": build_semantic_scores_cte(ANN_CANDIDATES_SQL),
+}
+
+CANDIDATE_SEMANTIC_SCORES_CTE = {
+    "exact": build_semantic_scores_cte(CANDIDATE_IDS_SQL),
+    "scan": build_semantic_scores_cte(CANDIDATE_IDS_SQL, use_centroids=False),
+    "ann": build_semantic_scores_cte(ann_candidates_sql(CANDIDATE_IDS_FILTER)),
+}
+
+SEMANTIC_SCORES_SELECT = """
+SELECT * FROM final_scores ORDER BY final_score DESC, product_id LIMIT :top_n
+"""
+
+SEMANTIC_SCORES_QUERY = {
+    mode: "WITH" + cte + SEMANTIC_SCORES_SELECT
+    for mode, cte in SEMANTIC_SCORES_CTE.items()
+}
+
+CANDIDATE_SEMANTIC_SCORES_QUERY = {
+    mode: "WITH" + cte + SEMANTIC_SCORES_SELECT
+    for mode, cte in CANDIDATE_SEMANTIC_SCORES_CTE.items()
+}
+
+# 카테고리 키워드가 있는 경우 해당 카테고리 제품만 점수를 계산 (idx_product_category 사용)
+CATEGORY_CANDIDATES_SQL = """
+    SELECT product_id FROM product WHERE product_category = CAST(:category AS varchar)"""
+CATEGORY_FILTER = "p.product_category = CAST(:category AS varchar)"
+
+CATEGORY_SEMANTIC_SCORES_CTE = {
+    "exact": build_semantic_scores_cte(CATEGORY_CANDIDATES_SQL),
+    "scan": build_semantic_scores_cte(CATEGORY_CANDIDATES_SQL, use_centroids=False),
+    "ann": build_semantic_scores_cte(ann_candidates_sql(CATEGORY_FILTER)),
+}
+
+# 상위 N개 제품의 상세 정보까지 같은 쿼리에서 조인 (recsys3)
+TOP_PRODUCTS_SELECT = """,
+top_scores AS (
+    SELECT * FROM final_scores ORDER BY final_score DESC, product_id LIMIT :top_n
+)
+SELECT
+    p.product_id,
+    p.product_category,
+    p.product_name,
+    p.brand_name,
+    p.original_price,
+    p.final_price
+FROM
+    top_scores t
+    JOIN product p ON p.product_id = t.product_id
+ORDER BY t.final_score DESC, t.product_id
+"""
+
+TOP_PRODUCTS_BY_SIMILARITY_QUERY = {
+    mode: "WITH" + cte + TOP_PRODUCTS_SELECT
+    for mode, cte in SEMANTIC_SCORES_CTE.items()
+}
+
+TOP_PRODUCTS_IN_CATEGORY_QUERY = {
+    mode: "WITH" + cte + TOP_PRODUCTS_SELECT
+    for mode, cte in CATEGORY_SEMANTIC_SCORES_CTE.items()
+}
+
+# recsys1: CBF/CF 결과를 semantic 단계의 후보로 사용
+HYBRID_CANDIDATES_SQL = """
+    SELECT rs.product_id
+    FROM recommendation_scores rs
+    JOIN product p ON p.product_id = rs.product_id
+    WHERE rs.final_score >= 0
+      AND (CAST(:category AS varchar) IS NULL OR p.product_category = CAST(:category AS varchar))"""
+
+HYBRID_SEMANTIC_SCORES_CTE = {
+    "exact": build_semantic_scores_cte(HYBRID_CANDIDATES_SQL),
+    "scan": build_semantic_scores_cte(HYBRID_CANDIDATES_SQL, use_centroids=False),
+}
+
+HYBRID_SELECT = """
+SELECT
+    p.product_id,
+    p.product_category,
+    p.product_name,
+    p.brand_name,
+    p.original_price,
+    p.final_price
+FROM
+    final_scores s
+    JOIN product p ON p.product_id = s.product_id
+ORDER BY s.final_score DESC, s.product_id
+LIMIT :top_n
+"""
+
+HYBRID_QUERY = {
+    mode: f"""
+WITH {USER_VECTOR_CTE},
+{CBF_CF_SCORES_CTE},
+{cte}
+{HYBRID_SELECT}
+"""
+    for mode, cte in HYBRID_SEMANTIC_SCORES_CTE.items()
+}
+
+def check_search_params(search_mode, ef_search=None, probes=None):
+    # ANN recall 조절값은 무시하지 않고, ann 이 아닌 검색에 주어지면 거부한다
+    if search_mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown search mode: {search_mode}")
+    if search_mode != "ann" and (ef_search is not None or probes is not None):
+        raise ValueError("ef_search/probes are only supported with search_mode=ann")
+
+async def semantic_search_params(db: AsyncSession, query: str, alpha, beta, gamma, search_mode="exact", ef_search=None, probes=None, ann_candidates=None):
+    check_search_params(search_mode, ef_search, probes)
+    params = {
+        "query_embedding": await query_embedding_cache.get(query),
+        "alpha": alpha,
+        "beta": beta,
+        "gamma": gamma,
+    }
+    if search_mode == "ann":
+        ann_candidates = ann_candidates or ANN_CANDIDATES
+        # ef_search 를 지정하지 않으면 후보 수만큼은 반환되도록 맞춘다
+        if ef_search is None:
+            ef_search = ann_candidates
+        if ef_search < ann_candidates:
+            raise ValueError(f"ef_search ({ef_search}) must be at least ann_candidates ({ann_candidates})")
+        if ef_search > HNSW_EF_SEARCH_MAX:
+            raise ValueError(f"ef_search must be at most {HNSW_EF_SEARCH_MAX}")
+        params["ann_candidates"] = ann_candidates
+        # 현재 트랜잭션에서만 적용되는 recall 조절값
+        await db.execute(text("SELECT set_config('hnsw.ef_search', :value, true)"), {"value": str(ef_search)})
+        if probes is not None:
+            await db.execute(text("SELECT set_config('ivfflat.probes', :value, true)"), {"value": str(probes)})
+    return params
+
+# 제품 상세 정보 (인메모리 검색 결과에 붙일 때 사용)
+PRODUCT_DETAILS_QUERY = """
+SELECT product_id, product_category, product_name, brand_name, original_price, final_price
+FROM product
+WHERE product_id = ANY(CAST(:product_ids AS integer[]))
+  AND (CAST(:category AS varchar) IS NULL OR product_category = CAST(:category AS varchar))
+"""
+
+async def fetch_product_details(db: AsyncSession, product_ids, category=None):
+    # 주어진 순서(유사도 순)를 유지한 채 제품 상세 정보를 가져온다
+    result = await db.execute(
+        text(PRODUCT_DETAILS_QUERY),
+        {"product_ids": [int(product_id) for product_id in product_ids], "category": category},
     )
-    SELECT * FROM final_scores ORDER BY final_score DESC LIMIT %s;
-    """ %(query_embedding, alpha, beta, gamma, gamma, gamma, alpha, beta, alpha + beta, top_n)
-    result = await db.execute(text(review_similarities_query))
+    details = pd.DataFrame(result.fetchall(), columns=result.keys())
+    order = {product_id: i for i, product_id in enumerate(product_ids)}
+    return details.sort_values(by='product_id', key=lambda ids: ids.map(order)).reset_index(drop=True)
+
+async def search_vector_index(query: str, alpha, beta, gamma, top_n, candidate_ids=None):
+    # 인메모리 인덱스 검색. 스냅샷이 없으면 None 을 반환해서 SQL 로 대체한다.
+    if not vector_index.refresh():
+        return None
+    query_embedding = await query_embedding_cache.get(query)
+    return vector_index.search(query_embedding, alpha, beta, gamma, top_n, candidate_ids)
+
+async def get_top_products_by_similarity(db: AsyncSession, query: str, alpha=1.0, beta=1.0, gamma=1.5, top_n=None, search_mode="exact", ef_search=None, probes=None, ann_candidates=None, candidate_ids=None):
+    # candidate_ids 가 주어지면 해당 제품들에 대해서만 유사도를 계산한다
+    check_search_params(search_mode, ef_search, probes)
+    if search_mode == "memory":
+        result_df = await search_vector_index(query, alpha, beta, gamma, top_n, candidate_ids)
+        if result_df is not None:
+            return result_df
+        search_mode = "exact"
+
+    # 쿼리를 임베딩 벡터로 변환
+    params = await semantic_search_params(db, query, alpha, beta, gamma, search_mode, ef_search, probes, ann_candidates)
+    if candidate_ids is not None:
+        params["candidate_ids"] = [int(product_id) for product_id in candidate_ids]
+        semantic_query = CANDIDATE_SEMANTIC_SCORES_QUERY[search_mode]
+    else:
+        semantic_query = SEMANTIC_SCORES_QUERY[search_mode]
+
+    # 제품명/리뷰 유사도를 하나의 파라미터 쿼리로 계산 (동시 요청, read-only replica 에서도 안전)
+    result = await db.execute(text(semantic_query), {**params, "top_n": top_n})
     final_scores = result.fetchall()
 
     # 결과 정리 및 출력
@@ -238,18 +519,91 @@ async def get_top_products_by_similarity(db: AsyncSession, query: str, alpha=1.0
     
     return result_df
 
+async def get_top_products_with_details(db: AsyncSession, query: str, alpha=1.0, beta=1.0, gamma=1.5, top_n=10, search_mode="exact", ef_search=None, probes=None, ann_candidates=None):
+    check_search_params(search_mode, ef_search, probes)
+    # memory 결과는 인덱스 스냅샷에 따라 달라지므로 스냅샷 버전을 키에 넣는다
+    index_version = vector_index.version if search_mode == "memory" and vector_index.refresh() else None
+    key = ("top_products", normalize_query(query), match_category(query), alpha, beta, gamma, top_n, search_mode, ef_search, probes, ann_candidates, index_version)
+    return await result_cache.get_or_compute(
+        db, key,
+        lambda: _get_top_products_with_details(db, query, alpha, beta, gamma, top_n, search_mode, ef_search, probes, ann_candidates),
+    )
+
+async def _get_top_products_with_details(db: AsyncSession, query: str, alpha, beta, gamma, top_n, search_mode, ef_search, probes, ann_candidates):
+    category = match_category(query)
+    if search_mode == "memory":
+        candidate_ids = await category_index.get(db, category) if category else None
+        top_products = await search_vector_index(query, alpha, beta, gamma, top_n, candidate_ids)
+        if top_products is not None:
+            return await fetch_product_details(db, top_products['product_id'].tolist())
+        search_mode = "exact"
+
+    # 카테고리 필터, 유사도 계산, 상위 N개 선택, 제품 상세 조인을 한 번에 수행
+    params = await semantic_search_params(db, query, alpha, beta, gamma, search_mode, ef_search, probes, ann_candidates)
+    if category:
+        params["category"] = category
+        top_products_query = TOP_PRODUCTS_IN_CATEGORY_QUERY[search_mode]
+    else:
+        top_products_query = TOP_PRODUCTS_BY_SIMILARITY_QUERY[search_mode]
+    result = await db.execute(text(top_products_query), {**params, "top_n": top_n})
+    columns = result.keys()
+    return pd.DataFrame(result.fetchall(), columns=columns)
+
+# TEMP VIEW 로 만들 점수 컬럼과 파이썬 타입
+VIEW_SCORE_COLUMNS = {
+    'product_id': int,
+    'name_similarity': float,
+    'review_count': int,
+    'used_count': int,
+    'avg_similarity': float,
+    'avg_similarity_used': float,
+    'final_score': float,
+}
+
 async def create_view_from_df(db: AsyncSession, df, view_name, query):
-    # 정확히 일치하는 단어가 있는지 확인
-    for keyword in FILTER_KEYWORDS:
-        if check_exact_match(query, keyword):
-            filtered_df = df[df['product_id'].isin(await get_filtered_product_ids(db, keyword))]
-            df = filtered_df
-            break
-
-    df_tuples = df.itertuples(index=False, name=None)
-    values = ', '.join([f"({', '.join(map(str, row))})" for row in df_tuples])# ', '.join(db.mogrify('(%s,%s,%s,%s,%s,%s,%s)', row).decode('utf-8') for row in df_tuples)
+    # 명시적으로 요청한 경우에만 사용. TEMP VIEW 이므로 현재 세션(트랜잭션)에서만 보인다.
+    category = match_category(query)
+    if category:
+        df = df[df['product_id'].isin(await get_filtered_product_ids(db, category))]
+
+    # CREATE VIEW 에는 바인드 파라미터를 쓸 수 없으므로, 점수는 같은 세션의 TEMP TABLE 에
+    # 배열 파라미터(unnest)로 넣고 뷰는 그 테이블을 조인한다
+    scores_table = f"{view_name}_scores"
+    await db.execute(text(f"""
+    CREATE TEMP TABLE IF NOT EXISTS {scores_table} (
+        product_id integer,
+        name_similarity float8,
+        review_count bigint,
+        used_count bigint,
+        avg_similarity float8,
+        avg_similarity_used float8,
+        final_score float8
+    )
+    """))
+    await db.execute(text(f"TRUNCATE {scores_table}"))
+    if not df.empty:
+        # NaN 은 NULL 로 바인드
+        params = {
+            column: [None if pd.isna(value) else cast(value) for value in df[column].tolist()]
+            for column, cast in VIEW_SCORE_COLUMNS.items()
+        }
+        await db.execute(
+            text(f"""
+            INSERT INTO {scores_table}
+            SELECT * FROM unnest(
+                CAST(:product_id AS integer[]),
+                CAST(:name_similarity AS float8[]),
+                CAST(:review_count AS bigint[]),
+                CAST(:used_count AS bigint[]),
+                CAST(:avg_similarity AS float8[]),
+                CAST(:avg_similarity_used AS float8[]),
+                CAST(:final_score AS float8[])
+            )
+            """),
+            params,
+        )
     create_view_query = f"""
-    CREATE OR REPLACE VIEW {view_name} AS
+    CREATE OR REPLACE TEMP VIEW {view_name} AS
     SELECT 
         p.*, 
         t.name_similarity,
@@ -261,87 +615,119 @@ async def create_view_from_df(db: AsyncSession, df, view_name, query):
     FROM 
         product p
     JOIN 
-        (VALUES {values}) AS t(product_id, name_similarity, review_count, used_count, avg_similarity, avg_similarity_used, final_score)
+        {scores_table} t
     ON 
         p.product_id = t.product_id;
     """
     
     await db.execute(text(create_view_query))
-    await db.commit()
 
-async def execute_custom_query(db: AsyncSession, query):
-    result = await db.execute(query)
+async def execute_custom_query(db: AsyncSession, query, params=None):
+    result = await db.execute(query, params)
     columns = result.keys()
     result = result.fetchall()
     return pd.DataFrame(result, columns=columns)
 
 async def get_top_products_by_category(db: AsyncSession, filtered_df: pd.DataFrame, query=None):
-    if query:
-        # 정확히 일치하는 단어가 있는지 확인
-        for keyword in FILTER_KEYWORDS:
-            if check_exact_match(query, keyword):
-                filtered_df = filtered_df[filtered_df['product_id'].isin(await get_filtered_product_ids(db, keyword))]
-                break
+    category = match_category(query) if query else None
+    if category:
+        filtered_df = filtered_df[filtered_df['product_id'].isin(await get_filtered_product_ids(db, category))]
 
     # Get top 10 product IDs based on final_score_semantic
     top_product_ids = filtered_df['product_id'].head(10).tolist()
 
-    # Fetch product details from the database
-    # result = await db.execute(select(Product).where(Product.product_id.in_(top_product_ids)))
-    result = await db.execute(
-        select(Product.product_id, Product.product_category, Product.product_name, Product.brand_name, Product.original_price, Product.final_price)
-        .where(Product.product_id.in_(top_product_ids))
-    )
-    # products = result.all()
-    columns = result.keys()
-    top_products = result.all()
-    return pd.DataFrame(top_products, columns=columns)
+    # Fetch product details from the database (점수 순서 유지)
+    return await fetch_product_details(db, top_product_ids)
 
 # 최종 결합 함수
-async def get_final_recommendations(db: AsyncSession, user_vector, query_sentence, category=None):
-    # 모델 초기화
-    # model = SentenceTransformer('bespin-global/klue-sroberta-base-continue-learning-by-mnr')
-    
-    # 1. final_scores 계산
-    final_scores_df = await calculate_final_scores(db, user_vector)
-    
-    # 2. final_scores_df에서 final_score >= 0인 데이터 필터링
-    filtered_df = final_scores_df[final_scores_df['final_score'] >= 0]
-    
-    # 3. 필터링된 데이터에서 semantic search 수행
-    filtered_product_ids = tuple(filtered_df['product_id'].tolist())
-    top_products = await get_top_products_by_similarity(db, query_sentence, alpha=1.0, beta=1.0, gamma=1.5, top_n=len(filtered_product_ids))
-    
-    # print(filtered_df)
-    # print(top_products)
-    # 4. 결과를 결합
-    merged_df = pd.merge(filtered_df, top_products, on='product_id', suffixes=('_recommendation', '_semantic'))
-    merged_df = merged_df.sort_values(by='final_score_semantic', ascending=False)
-    
-    return merged_df
+async def get_final_recommendations(db: AsyncSession, user_vector, query_sentence, category=None, search_mode="exact", ef_search=None, probes=None, top_n=10, scoring="sql"):
+    # 결합 쿼리는 exact/scan/memory 만 지원한다. ann 후보 검색과 ef_search/probes 는
+    # 결합 쿼리에 쓰이지 않으므로 무시하지 않고 거부한다.
+    if search_mode not in ("exact", "scan", "memory"):
+        raise ValueError(f"search_mode={search_mode} is not supported for combined recommendations")
+    check_search_params(search_mode, ef_search, probes)
+    if search_mode == "memory" and not vector_index.refresh():
+        # 스냅샷이 없으면 SQL exact 와 같은 결과
+        search_mode = "exact"
+    category = category or match_category(query_sentence)
+    # 캐시 키에는 결과에 영향을 주는 값만 넣는다 (scoring 은 memory 경로에서만 사용).
+    # memory 경로는 인덱스/엔진 스냅샷 버전도 넣어서, 스냅샷이 바뀌면 다시 계산한다.
+    snapshot = None
+    if search_mode == "memory":
+        if scoring == "numpy":
+            await score_engine.refresh(db)
+        snapshot = (vector_index.version, score_engine.loaded_at if scoring == "numpy" else None)
+    key = (
+        "final_recommendations", profile_bitmask(user_vector_params(user_vector)), normalize_query(query_sentence),
+        category, search_mode, top_n, scoring if search_mode == "memory" else None, snapshot,
+    )
+    return await result_cache.get_or_compute(
+        db, key,
+        lambda: _get_final_recommendations(db, user_vector, query_sentence, category, search_mode, top_n, scoring),
+    )
+
+async def _get_final_recommendations(db: AsyncSession, user_vector, query_sentence, category, search_mode, top_n, scoring):
+    # CBF/CF 점수가 0 이상인 제품(+카테고리)만 후보로 semantic 점수를 계산하고
+    # 상위 top_n 개의 제품 정보를 바로 반환한다
+    if search_mode == "memory":
+        final_scores_df = await calculate_final_scores(db, user_vector, scoring)
+        candidate_ids = final_scores_df.loc[final_scores_df['final_score'] >= 0, 'product_id'].tolist()
+        top_products = await get_top_products_by_similarity(db, query_sentence, alpha=1.0, beta=1.0, gamma=1.5, search_mode="memory", candidate_ids=candidate_ids)
+        details = await fetch_product_details(db, top_products['product_id'].tolist(), category)
+        return details.head(top_n)
+
+    params = await semantic_search_params(db, query_sentence, alpha=1.0, beta=1.0, gamma=1.5, search_mode=search_mode)
+    params.update(user_vector_params(user_vector))
+    result = await db.execute(text(HYBRID_QUERY[search_mode]), {**params, "category": category, "top_n": top_n})
+    return pd.DataFrame(result.fetchall(), columns=result.keys())
 
 
 # 필터링해야 할 단어 목록
 FILTER_KEYWORDS = ['크림', '에센스', '폼 클렌저', '미스트', '오일', '필링', '선크림', '토너', '클렌징 워터', '로션']
 
-def check_exact_match(query, keyword):
-    # 정규 표현식을 사용하여 정확히 일치하는 단어가 있는지 확인
-    pattern = r'\b' + re.escape(keyword) + r'\b'
-    return bool(re.search(pattern, query))
+# 모든 키워드를 한 번에 찾는 정규식 (긴 키워드 우선)
+KEYWORD_ORDER = {keyword: i for i, keyword in enumerate(FILTER_KEYWORDS)}
+KEYWORD_PATTERN = re.compile(
+    r'\b(?:' + '|'.join(re.escape(keyword) for keyword in sorted(FILTER_KEYWORDS, key=len, reverse=True)) + r')\b'
+)
 
-async def get_filtered_product_ids(db: AsyncSession, keyword):
-    query = """
-    SELECT product_id FROM product WHERE product_category = '%s';
-    """ %(keyword)
-    result = await db.execute(text(query))
-    result = result.fetchall()
-    return [row[0] for row in result]
+def match_category(query):
+    # 쿼리에 정확히 포함된 카테고리 키워드 중 FILTER_KEYWORDS 순서가 가장 빠른 것 (없으면 None)
+    matches = KEYWORD_PATTERN.findall(query)
+    if not matches:
+        return None
+    return min(matches, key=KEYWORD_ORDER.get)
 
-async def execute_custom_query(db: AsyncSession, query):
-    result = await db.execute(query)
-    columns = result.keys()
-    result = result.fetchall()
-    return pd.DataFrame(result, columns=columns)
+CATEGORY_INDEX_TTL = float(os.getenv("CATEGORY_INDEX_TTL", "60"))
+
+class CategoryIndex:
+    """product_category -> product_id 집합.
+
+    crud 에서 제품이 바뀌면 invalidate 되고, 다른 워커의 변경은 TTL 이 지나면 다시 읽는다.
+    """
+
+    def __init__(self, ttl=CATEGORY_INDEX_TTL):
+        self.ttl = ttl
+        self._product_ids = None
+        self._loaded_at = 0.0
+
+    def invalidate(self):
+        self._product_ids = None
+
+    async def get(self, db: AsyncSession, category) -> frozenset:
+        if self._product_ids is None or time.monotonic() - self._loaded_at > self.ttl:
+            result = await db.execute(text(
+                "SELECT product_category, array_agg(product_id) FROM product "
+                "WHERE product_category IS NOT NULL GROUP BY product_category"
+            ))
+            self._product_ids = {row[0]: frozenset(row[1]) for row in result.fetchall()}
+            self._loaded_at = time.monotonic()
+        return self._product_ids.get(category, frozenset())
+
+category_index = CategoryIndex()
+
+async def get_filtered_product_ids(db: AsyncSession, keyword):
+    return await category_index.get(db, keyword)
 
 
 if __name__ == "__main__":
@@ -1,100 +1,171 @@
 from sqlalchemy.future import select
-from sqlalchemy import func, case
+from sqlalchemy import func, case, literal, or_, and_, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
 from .models import Review, Product, Reviewer
+from .database import SessionLocal
 from datetime import datetime
+import io
+import os
+import csv
+import json
+import base64
+import binascii
 import pandas as pd
 
-async def get_reviews_by_product_and_keyword(db: AsyncSession, product_name: str, keyword: str):
-    print(product_name, keyword)
-    result = await db.execute(select(Review).where(Review.product_name.like(f'%{product_name}%{keyword}%')))
-    result_reviews = result.scalars().all()
-    # 리뷰 데이터를 DataFrame으로 변환
-    review_data = [
-        {
-            "product_name": review.product_name,
-            "reviewer_name": review.reviewer_name,
-            "rating": review.rating,
-            "used_over_one_month": review.used_over_one_month,
-            "repurchase_intention": review.repurchase_intention,
-            "skin_type_review": review.skin_type_review,
-            "skin_concern_review": review.skin_concern_review,
-            "irritation_level_review": review.irritation_level_review,
-            "cleansing_power_review": review.cleansing_power_review,
-            "spreadability_review": review.spreadability_review,
-            "review_content": review.review_content,
-            "review_date": review.review_date,
-        }
-        for review in result_reviews
-    ]
-    result_df = pd.DataFrame(review_data)
-    return result_df
+# 리뷰 목록 페이지 크기 기본값과 상한
+REVIEW_PAGE_SIZE = int(os.getenv("REVIEW_PAGE_SIZE", "50"))
+REVIEW_PAGE_SIZE_MAX = int(os.getenv("REVIEW_PAGE_SIZE_MAX", "500"))
+# 스트리밍 내보내기에서 서버 측 커서로 한 번에 읽는 행 수
+REVIEW_STREAM_BATCH_SIZE = int(os.getenv("REVIEW_STREAM_BATCH_SIZE", "1000"))
 
-async def get_reviews_by_rating(db: AsyncSession, product_id: int, rating: int):
-    result = await db.execute(select(Review).where((Review.product_id==product_id) & (Review.rating==rating)))
-    result_reviews = result.scalars().all()
-    # 리뷰 데이터를 DataFrame으로 변환
-    review_data = [
-        {
-            "product_name": review.product_name,
-            "reviewer_name": review.reviewer_name,
-            "rating": review.rating,
-            "used_over_one_month": review.used_over_one_month,
-            "repurchase_intention": review.repurchase_intention,
-            "skin_type_review": review.skin_type_review,
-            "skin_concern_review": review.skin_concern_review,
-            "irritation_level_review": review.irritation_level_review,
-            "cleansing_power_review": review.cleansing_power_review,
-            "spreadability_review": review.spreadability_review,
-            "review_content": review.review_content,
-            "review_date": review.review_date,
-        }
-        for review in result_reviews
-    ]
-    result_df = pd.DataFrame(review_data)
-    return result_df
+# 목록 조회에 내려주는 컬럼만 선택한다 (임베딩 등은 읽지 않음)
+REVIEW_LISTING_COLUMNS = [
+    Review.review_id,
+    Review.product_name,
+    Review.reviewer_name,
+    Review.rating,
+    Review.used_over_one_month,
+    Review.repurchase_intention,
+    Review.skin_type_review,
+    Review.skin_concern_review,
+    Review.irritation_level_review,
+    Review.cleansing_power_review,
+    Review.spreadability_review,
+    Review.review_content,
+    Review.review_date,
+]
+
+PRODUCT_SUMMARY_COLUMNS = [
+    Product.product_name,
+    Product.number_of_reviews,
+    Product.review_5_star_ratio,
+    Product.review_4_star_ratio,
+    Product.review_3_star_ratio,
+    Product.review_2_star_ratio,
+    Product.review_1_star_ratio,
+]
+
+
+async def _fetch_df(db: AsyncSession, query) -> pd.DataFrame:
+    # ORM 객체를 만들지 않고 결과 행을 바로 DataFrame 으로 변환
+    result = await db.execute(query)
+    return pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+
+
+def encode_cursor(values) -> str:
+    # 마지막 행의 정렬 키를 클라이언트가 해석하지 않는 토큰으로 만든다
+    payload = json.dumps(values, default=lambda value: value.isoformat())
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str, types) -> list:
+    """encode_cursor 토큰을 정렬 키 값 목록으로 되돌린다. 잘못된 토큰이면 ValueError."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError
+        return [convert(value) for convert, value in zip(types, values)]
+    except (binascii.Error, UnicodeError, TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+
+async def _fetch_page(db: AsyncSession, query, limit: int, cursor_key) -> dict:
+    # limit + 1 개를 읽어 다음 페이지가 있는지 확인한다
+    result = await db.execute(query.limit(limit + 1))
+    rows = result.fetchall()
+    next_cursor = encode_cursor(cursor_key(rows[limit - 1])) if len(rows) > limit else None
+    return {
+        "items": [dict(row._mapping) for row in rows[:limit]],
+        "next_cursor": next_cursor,
+        "limit": limit,
+    }
+
+
+def _keyword_conditions(product_name: str, keyword: str):
+    # 기본 검색 조건은 원래대로 product_name LIKE '%name%keyword%' 이고, product_name 의
+    # pg_trgm GIN 인덱스(migrations.create_review_search_indexes)가 이 조건을 처리한다.
+    # 같은 뜻인 LIKE '%name%' 를 AND 로 더해 2글자 키워드처럼 trigram 이 없는 경우에도 후보를 줄인다.
+    keyword_match = Review.product_name.like(f'%{product_name}%{keyword}%')
+    return [Review.product_name.like(f'%{product_name}%')], keyword_match
+
+
+def reviews_by_keyword_query(product_name: str, keyword: str):
+    conditions, keyword_match = _keyword_conditions(product_name, keyword)
+    return select(*REVIEW_LISTING_COLUMNS).where(*conditions, keyword_match).order_by(Review.review_id)
+
+
+def reviews_by_rating_query(product_id: int, rating: int):
+    # (product_id, rating, review_id) 인덱스 순서로 읽는다
+    return (
+        select(*REVIEW_LISTING_COLUMNS)
+        .where((Review.product_id==product_id) & (Review.rating==rating))
+        .order_by(Review.review_id)
+    )
+
+
+def reviews_by_date_range_query(start_date: datetime, end_date: datetime):
+    # (review_date, review_id) 인덱스 순서로 읽는다
+    return (
+        select(*REVIEW_LISTING_COLUMNS)
+        .where(Review.review_date.between(start_date, end_date))
+        .order_by(Review.review_date, Review.review_id)
+    )
 
-async def get_reviews_by_date_range(db: AsyncSession, start_date: datetime, end_date: datetime):
-    result = await db.execute(select(Review).where(Review.review_date.between(start_date, end_date)))
-    result_reviews = result.scalars().all()
-    # 리뷰 데이터를 DataFrame으로 변환
-    review_data = [
-        {
-            "product_name": review.product_name,
-            "reviewer_name": review.reviewer_name,
-            "rating": review.rating,
-            "used_over_one_month": review.used_over_one_month,
-            "repurchase_intention": review.repurchase_intention,
-            "skin_type_review": review.skin_type_review,
-            "skin_concern_review": review.skin_concern_review,
-            "irritation_level_review": review.irritation_level_review,
-            "cleansing_power_review": review.cleansing_power_review,
-            "spreadability_review": review.spreadability_review,
-            "review_content": review.review_content,
-            "review_date": review.review_date,
-        }
-        for review in result_reviews
-    ]
-    result_df = pd.DataFrame(review_data)
-    return result_df
+
+def reviews_by_brand_query(brand_name: str):
+    return (
+        select(*REVIEW_LISTING_COLUMNS)
+        .join(Product, Review.product_id == Product.product_id)
+        .where(Product.brand_name == brand_name)
+        .order_by(Review.review_id)
+    )
+
+
+async def get_reviews_by_product_and_keyword(
+    db: AsyncSession, product_name: str, keyword: str, ranked: bool = False, limit: int = REVIEW_PAGE_SIZE, cursor: str = None
+):
+    conditions, keyword_match = _keyword_conditions(product_name, keyword)
+    if ranked:
+        # ranked=true 에서만 review_content 도 검색한다: 키워드를 포함하거나(LIKE) 오타/띄어쓰기가
+        # 달라도 비슷한(<%) 리뷰를 더하고 단어 유사도 순으로 정렬
+        score = func.word_similarity(keyword, Review.review_content)
+        keyword_match = or_(
+            keyword_match,
+            Review.review_content.like(f'%{keyword}%'),
+            literal(keyword).op('<%')(Review.review_content),
+        )
+        query = select(*REVIEW_LISTING_COLUMNS, score.label('score')).order_by(score.desc(), Review.review_id)
+        if cursor:
+            last_score, last_id = decode_cursor(cursor, (float, int))
+            conditions.append(or_(score < last_score, and_(score == last_score, Review.review_id > last_id)))
+        cursor_key = lambda row: [row.score, row.review_id]
+        query = query.where(*conditions, keyword_match)
+    else:
+        query = reviews_by_keyword_query(product_name, keyword)
+        if cursor:
+            (last_id,) = decode_cursor(cursor, (int,))
+            query = query.where(Review.review_id > last_id)
+        cursor_key = lambda row: [row.review_id]
+    return await _fetch_page(db, query, limit, cursor_key)
+
+async def get_reviews_by_rating(db: AsyncSession, product_id: int, rating: int, limit: int = REVIEW_PAGE_SIZE, cursor: str = None):
+    query = reviews_by_rating_query(product_id, rating)
+    if cursor:
+        (last_id,) = decode_cursor(cursor, (int,))
+        query = query.where(Review.review_id > last_id)
+    return await _fetch_page(db, query, limit, lambda row: [row.review_id])
+
+async def get_reviews_by_date_range(
+    db: AsyncSession, start_date: datetime, end_date: datetime, limit: int = REVIEW_PAGE_SIZE, cursor: str = None
+):
+    query = reviews_by_date_range_query(start_date, end_date)
+    if cursor:
+        last_date, last_id = decode_cursor(cursor, (datetime.fromisoformat, int))
+        query = query.where(tuple_(Review.review_date, Review.review_id) > tuple_(last_date, last_id))
+    return await _fetch_page(db, query, limit, lambda row: [row.review_date, row.review_id])
 
 async def get_review_count_and_average_star_by_product(db: AsyncSession, product_id: int):
-    result = await db.execute(select(Product).where(Product.product_id==product_id))
-    result = result.scalars().all()
-    product_data = [
-        {
-            "product_name": product.product_name,
-            "number_of_reviews": product.number_of_reviews,
-            "review_5_star_ratio": product.review_5_star_ratio,
-            "review_4_star_ratio": product.review_4_star_ratio,
-            "review_3_star_ratio": product.review_3_star_ratio,
-            "review_2_star_ratio": product.review_2_star_ratio,
-            "review_1_star_ratio": product.review_1_star_ratio,
-        }
-        for product in result
-    ]
-    result_df = pd.DataFrame(product_data)
-    return result_df
+    return await _fetch_df(db, select(*PRODUCT_SUMMARY_COLUMNS).where(Product.product_id==product_id))
 
 async def get_brand_review_ratios(db: AsyncSession, brand_name: str):
     result = await db.execute(
@@ -109,4 +180,51 @@ async def get_brand_review_ratios(db: AsyncSession, brand_name: str):
     )
     result_reviews = result.fetchall()
     result_df = pd.DataFrame(result_reviews, columns=['brand_name', 'total_reviews', 'used_over_one_month_ratio', 'repurchase_intention_ratio'])
-    return result_df
\ No newline at end of file
+    return result_df
+
+
+async def iter_review_batches(query, batch_size: int = REVIEW_STREAM_BATCH_SIZE):
+    """서버 측 커서(yield_per)로 batch_size 행씩 읽어 행(dict) 목록을 생성한다.
+
+    StreamingResponse 가 요청 핸들러보다 오래 살아 있으므로 세션을 직접 연다.
+    """
+    async with SessionLocal() as db:
+        result = await db.stream(query.execution_options(yield_per=batch_size))
+        async for rows in result.partitions():
+            yield [dict(row._mapping) for row in rows]
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+async def iter_ndjson(batches):
+    async for rows in batches:
+        yield "".join(json.dumps(row, ensure_ascii=False, default=_json_default) + "\n" for row in rows)
+
+
+async def iter_csv(batches, columns):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns)
+    writer.writeheader()
+    async for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # 결과가 없어도 헤더는 보낸다
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+STREAM_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+
+def stream_reviews(query, format: str = "ndjson"):
+    """쿼리 결과를 NDJSON 또는 CSV 문자열 조각으로 내보내는 (생성기, media type) 을 반환한다."""
+    batches = iter_review_batches(query)
+    if format == "csv":
+        return iter_csv(batches, list(query.selected_columns.keys())), STREAM_MEDIA_TYPES["csv"]
+    return iter_ndjson(batches), STREAM_MEDIA_TYPES["ndjson"]
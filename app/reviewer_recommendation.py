@@ -0,0 +1,156 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from .recsys import USER_VECTOR_FIELDS, user_vector_params
+from .score_engine import score_engine, user_groups
+
+# 사용법: python -m app.reviewer_recommendation --shards 4 [--stale-only]
+RECOMMENDATION_TOP_N = int(os.getenv("RECOMMENDATION_TOP_N", "10"))
+WRITE_CHUNK_SIZE = 1000
+
+REVIEWER_PROFILES_QUERY = f"""
+SELECT rv.reviewer_id, {", ".join("rv." + field for field in USER_VECTOR_FIELDS)}
+FROM reviewer rv
+LEFT JOIN reviewer_recommendation rr ON rr.reviewer_id = rv.reviewer_id
+WHERE rv.reviewer_id % CAST(:shards AS integer) = CAST(:shard AS integer)
+  AND (NOT CAST(:stale_only AS boolean) OR rr.reviewer_id IS NULL OR rr.stale_at IS NOT NULL)
+  AND (CAST(:reviewer_id AS integer) IS NULL OR rv.reviewer_id = CAST(:reviewer_id AS integer))
+"""
+
+# 계산 도중 다시 stale 로 표시된 행(stale_at > computed_at)은 그대로 둔다
+UPSERT_RECOMMENDATION_QUERY = """
+INSERT INTO reviewer_recommendation AS rr (reviewer_id, profile, product_ids, final_scores, computed_at, stale_at)
+VALUES (
+    :reviewer_id,
+    CAST(:profile AS integer[]),
+    CAST(:product_ids AS integer[]),
+    CAST(:final_scores AS float8[]),
+    :computed_at,
+    NULL
+)
+ON CONFLICT (reviewer_id) DO UPDATE
+SET profile = EXCLUDED.profile,
+    product_ids = EXCLUDED.product_ids,
+    final_scores = EXCLUDED.final_scores,
+    computed_at = EXCLUDED.computed_at,
+    stale_at = CASE WHEN rr.stale_at > EXCLUDED.computed_at THEN rr.stale_at END
+"""
+
+LOOKUP_QUERY = """
+SELECT
+    rr.computed_at,
+    rr.stale_at,
+    p.product_id,
+    p.product_category,
+    p.product_name,
+    p.brand_name,
+    p.original_price,
+    p.final_price,
+    t.final_score
+FROM reviewer_recommendation rr
+LEFT JOIN LATERAL unnest(rr.product_ids, rr.final_scores) WITH ORDINALITY AS t(product_id, final_score, rank) ON true
+LEFT JOIN product p ON p.product_id = t.product_id
+WHERE rr.reviewer_id = :reviewer_id
+ORDER BY t.rank
+"""
+
+
+async def compute_reviewer_recommendations(
+    db: AsyncSession, shard=0, shards=1, stale_only=False, reviewer_id=None, top_n=RECOMMENDATION_TOP_N
+) -> int:
+    """리뷰어의 recsys2 상위 top_n 개를 계산해 reviewer_recommendation 에 저장하고 저장한 행 수를 반환한다.
+
+    reviewer_id % shards == shard 인 리뷰어만 처리한다. stale_only 이면 결과가 없거나 stale 인 리뷰어만 다시 계산한다.
+    """
+    # 요청마다 전체를 다시 읽지 않고 TTL 이 지난 경우에만 다시 로드한다.
+    # 엔진이 데이터를 읽은 시각 이후에 stale 로 표시된 행은 저장 후에도 stale 로 남는다.
+    await score_engine.refresh(db)
+    snapshot = score_engine.snapshot
+    computed_at = snapshot.data_time
+
+    result = await db.execute(
+        text(REVIEWER_PROFILES_QUERY),
+        {"shard": shard, "shards": shards, "stale_only": stale_only, "reviewer_id": reviewer_id},
+    )
+    reviewers = pd.DataFrame(result.fetchall(), columns=result.keys())
+    await db.commit()
+    if reviewers.empty:
+        return 0
+
+    profiles = [user_vector_params(row) for row in reviewers.to_dict(orient="records")]
+    rows = []
+    for profile, recommendations in zip(profiles, snapshot.top_products_batch(profiles, top_n)):
+        rows.append({
+            "reviewer_id": profile["reviewer_id"],
+            "profile": user_groups(profile).tolist(),
+            "product_ids": [r["product_id"] for r in recommendations],
+            "final_scores": [r["final_score"] for r in recommendations],
+            "computed_at": computed_at,
+        })
+    for start in range(0, len(rows), WRITE_CHUNK_SIZE):
+        await db.execute(text(UPSERT_RECOMMENDATION_QUERY), rows[start:start + WRITE_CHUNK_SIZE])
+        await db.commit()
+    return len(rows)
+
+
+async def get_reviewer_recommendations(db: AsyncSession, reviewer_id: int):
+    """저장된 추천 결과 (없으면 None). 인덱스 한 번 조회로 제품 정보까지 가져온다."""
+    result = await db.execute(text(LOOKUP_QUERY), {"reviewer_id": reviewer_id})
+    rows = result.mappings().all()
+    if not rows:
+        return None
+    return {
+        "reviewer_id": reviewer_id,
+        "computed_at": rows[0]["computed_at"],
+        "stale": rows[0]["stale_at"] is not None,
+        "recommendations": [
+            {key: value for key, value in row.items() if key not in ("computed_at", "stale_at")}
+            for row in rows
+            if row["product_id"] is not None
+        ],
+    }
+
+
+def _run_shard(shard, shards, stale_only, top_n):
+    # 프로세스마다 별도의 엔진(연결 풀)을 사용한다
+    from .database import SessionLocal, engine
+
+    async def run():
+        async with SessionLocal() as db:
+            count = await compute_reviewer_recommendations(db, shard, shards, stale_only, top_n=top_n)
+        await engine.dispose()
+        return count
+
+    return asyncio.run(run())
+
+
+def main(shards=1, stale_only=False, top_n=RECOMMENDATION_TOP_N):
+    start = time.perf_counter()
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=shards, mp_context=context) as executor:
+        counts = list(executor.map(
+            _run_shard, range(shards), [shards] * shards, [stale_only] * shards, [top_n] * shards
+        ))
+    elapsed = time.perf_counter() - start
+    print(json.dumps({
+        "reviewers": sum(counts),
+        "shards": counts,
+        "seconds": round(elapsed, 3),
+    }), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shards", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--stale-only", action="store_true")
+    parser.add_argument("--top-n", type=int, default=RECOMMENDATION_TOP_N)
+    args = parser.parse_args()
+    main(args.shards, args.stale_only, args.top_n)
@@ -1,6 +1,14 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
 from typing import List, Optional
 from datetime import datetime
+import numpy as np
+
+
+def embedding_to_list(value):
+    # ORM 에서는 float32 ndarray 로 읽히므로 응답용 list 로 변환
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return value
 
 
 class ReviewBase(BaseModel):
@@ -27,6 +35,11 @@ class Review(ReviewBase):
     review_id: int
     review_content_embedding: Optional[List[float]] = None
 
+    @field_validator("review_content_embedding", mode="before")
+    @classmethod
+    def embedding_as_list(cls, value):
+        return embedding_to_list(value)
+
     class Config:
         orm_mode = True
 
@@ -109,6 +122,11 @@ class Product(ProductBase):
     product_id: int
     product_name_embedding: Optional[List[float]] = None
 
+    @field_validator("product_name_embedding", mode="before")
+    @classmethod
+    def embedding_as_list(cls, value):
+        return embedding_to_list(value)
+
     class Config:
         orm_mode = True
 
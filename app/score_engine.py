@@ -0,0 +1,231 @@
+import os
+import time
+import asyncio
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# 배열을 다시 읽는 주기(초)
+SCORE_ENGINE_REFRESH_SECONDS = float(os.getenv("SCORE_ENGINE_REFRESH_SECONDS", "60"))
+
+# CBF 에 사용하는 제품 속성 (COALESCE(p.x::int, 0))
+PRODUCT_FEATURES = [
+    "skin_type_oily",
+    "cleansing_power_very_satisfied",
+    "skin_concern_soothing",
+    "irritation_level_not_irritating",
+    "skin_type_combination",
+    "skin_concern_wrinkles_whitening",
+    "skin_type_dry",
+]
+
+PRODUCT_QUERY = f"""
+SELECT
+    product_id,
+    product_name,
+    brand_name,
+    number_of_reviews,
+    {", ".join(f"COALESCE({feature}::int, 0) AS {feature}" for feature in PRODUCT_FEATURES)}
+FROM product
+ORDER BY product_id
+"""
+
+SIGNATURE_QUERY = """
+SELECT
+    sig_oily, sig_excess_sebum, sig_trouble, sig_combination, sig_whitening_wrinkles, sig_dry,
+    product_id,
+    weighted_rating_sum::float8 AS weighted_rating_sum,
+    rated_count,
+    review_count
+FROM reviewer_signature_rating
+"""
+
+RESULT_COLUMNS = ['product_id', 'product_name', 'brand_name', 'product_score', 'similar_user_score', 'brand_score', 'final_score', 'number_of_reviews']
+
+
+SIGNATURE_COLUMNS = ["sig_oily", "sig_excess_sebum", "sig_trouble", "sig_combination", "sig_whitening_wrinkles", "sig_dry"]
+
+
+def user_groups(user_vector) -> np.ndarray:
+    # 사용자 프로필을 제품 속성/리뷰어 시그니처와 같은 6개 그룹으로 묶는다
+    u = {field: int(bool(value)) for field, value in user_vector.items() if field != "reviewer_id"}
+    return np.array([
+        u["skin_type_oily"],
+        u["skin_concern_excess_sebum"],
+        u["skin_type_trouble_prone"] + u["skin_type_sensitive"] + u["skin_concern_trouble"] + u["skin_concern_atopy"],
+        u["skin_type_combination"] + u["skin_type_normal"],
+        u["skin_concern_whitening"] + u["skin_concern_wrinkles"],
+        u["skin_type_dry"] + u["skin_type_mildly_dry"],
+    ], dtype=np.int64)
+
+
+def z_scores(values: np.ndarray) -> np.ndarray:
+    # 행(프로필)마다 SQL 의 (x - AVG(x) OVER ()) / STDDEV(x) OVER () 를 계산한다.
+    # NULL(NaN)은 제외하고 표본 표준편차를 사용한다.
+    valid = ~np.isnan(values)
+    count = valid.sum(axis=1, keepdims=True)
+    filled = np.where(valid, values, 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = filled.sum(axis=1, keepdims=True) / count
+        var = (np.where(valid, values - mean, 0.0) ** 2).sum(axis=1, keepdims=True) / (count - 1)
+        z = (values - mean) / np.sqrt(var)
+    # 값이 2개 미만이거나 모두 같으면(SQL 에서는 NULL 또는 0 으로 나누기 오류) 점수를 매기지 않는다
+    spread = np.where(valid, values, -np.inf).max(axis=1) - np.where(valid, values, np.inf).min(axis=1)
+    degenerate = (count[:, 0] < 2) | ~(spread > 0)
+    z[degenerate] = np.nan
+    return z
+
+
+class ScoreSnapshot:
+    """ScoreEngine 이 한 번에 읽은 제품/시그니처 배열. 만든 뒤에는 바꾸지 않는다.
+
+    load() 는 새 스냅샷을 만들어 통째로 교체하므로, 스냅샷 참조를 잡아 둔 계산은
+    도중에 refresh 가 일어나도 한 시점의 데이터만 사용한다.
+    """
+
+    def __init__(self, products: pd.DataFrame, signatures: pd.DataFrame, data_time=None):
+        f = products[PRODUCT_FEATURES].to_numpy(dtype=np.float64)
+        # 사용자 그룹과 곱할 수 있게 제품 속성도 6개 그룹으로 묶는다
+        self._features = np.stack([f[:, 0], f[:, 1], f[:, 2] + f[:, 3], f[:, 4], f[:, 5], f[:, 6]], axis=1)
+        number_of_reviews = products["number_of_reviews"].to_numpy(dtype=np.float64, na_value=np.nan)
+        self._eligible = number_of_reviews >= 100
+        self._products = products[["product_id", "product_name", "brand_name", "number_of_reviews"]]
+
+        # NULL 브랜드도 하나의 그룹(마지막 열)으로 브랜드 평균/표준편차 계산에 포함된다
+        codes, brands = pd.factorize(products["brand_name"], use_na_sentinel=True)
+        groups = np.where(codes >= 0, codes, len(brands))
+        self._brand_codes = codes
+        self._brand_onehot = np.zeros((len(products), len(brands) + 1))
+        self._brand_onehot[np.arange(len(products)), groups] = 1.0
+        self._brand_exists = self._eligible.astype(np.float64) @ self._brand_onehot > 0
+
+        # 시그니처 x 제품 행렬 (가중 평점 합, 평점 수, 리뷰 수)
+        product_rows = pd.Index(products["product_id"])
+        signatures = signatures[signatures["product_id"].isin(product_rows)]
+        keys, key_rows = np.unique(signatures[SIGNATURE_COLUMNS].to_numpy(dtype=np.int64), axis=0, return_inverse=True)
+        columns = product_rows.get_indexer(signatures["product_id"])
+        sums = np.zeros((3, len(keys), len(products)))
+        for i, field in enumerate(["weighted_rating_sum", "rated_count", "review_count"]):
+            np.add.at(sums[i], (key_rows.reshape(-1), columns), signatures[field].to_numpy(dtype=np.float64))
+        self._signatures = keys.astype(np.float64)
+        self._signature_sums = sums
+        # 데이터를 읽은 DB 시각 (이후의 쓰기는 반영되지 않았을 수 있다)
+        self.data_time = data_time
+
+    def score_groups(self, groups: np.ndarray):
+        """(프로필 수 x 6) 그룹 행렬에 대해 (프로필 수 x 제품 수) 점수 행렬들을 반환한다."""
+        groups = np.asarray(groups, dtype=np.float64)
+
+        # product_scores / z_scores_product
+        raw_score = groups @ self._features.T
+        raw_score[:, ~self._eligible] = np.nan
+        product_score = z_scores(raw_score)
+
+        # similar_signatures / average_ratings / z_scores_similar_users
+        similar = (groups @ self._signatures.T >= 2).astype(np.float64)
+        rating_sum, rated_count, review_count = (similar @ sums for sums in self._signature_sums)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            avg_rating = np.where(rated_count > 0, rating_sum / review_count, np.nan)
+        similar_user_score = z_scores(avg_rating)
+
+        # brand_scores / z_scores_brand
+        has_score = ~np.isnan(product_score)
+        group_sum = np.where(has_score, product_score, 0.0) @ self._brand_onehot
+        group_count = has_score.astype(np.float64) @ self._brand_onehot
+        with np.errstate(divide="ignore", invalid="ignore"):
+            avg_brand_score = np.where((group_count > 0) & self._brand_exists, group_sum / group_count, np.nan)
+        brand_z = z_scores(avg_brand_score)
+        brand_score = np.full_like(product_score, np.nan)
+        named = self._brand_codes >= 0
+        brand_score[:, named] = brand_z[:, self._brand_codes[named]]
+
+        # recommendation_scores
+        final_score = 0.2 * product_score + 0.7 * similar_user_score + 0.1 * brand_score
+        return product_score, similar_user_score, brand_score, final_score
+
+    def score(self, user_vector) -> pd.DataFrame:
+        product_score, similar_user_score, brand_score, final_score = (
+            scores[0] for scores in self.score_groups(user_groups(user_vector)[None, :])
+        )
+        idx = np.flatnonzero(final_score >= 0)
+        idx = idx[np.argsort(-final_score[idx], kind="stable")]
+
+        result = self._products.iloc[idx].reset_index(drop=True)
+        result["product_score"] = product_score[idx]
+        result["similar_user_score"] = similar_user_score[idx]
+        result["brand_score"] = brand_score[idx]
+        result["final_score"] = final_score[idx]
+        return result[RESULT_COLUMNS]
+
+    def top_products_batch(self, user_vectors, top_n=10, chunk_size=256):
+        """여러 프로필의 상위 top_n 제품 (product_id, final_score) 목록을 입력 순서대로 생성한다.
+
+        점수는 프로필의 6개 그룹 값에만 의존하므로 같은 그룹 값을 가진 프로필은 한 번만 계산한다.
+        """
+        groups = np.array([user_groups(user_vector) for user_vector in user_vectors], dtype=np.int64)
+        if len(groups) == 0:
+            return
+        unique_groups, inverse = np.unique(groups, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        product_ids = self._products["product_id"].to_numpy()
+
+        top = [None] * len(unique_groups)
+        for start in range(0, len(unique_groups), chunk_size):
+            final_score = self.score_groups(unique_groups[start:start + chunk_size])[3]
+            ranked = np.where(final_score >= 0, final_score, -np.inf)
+            k = min(top_n, ranked.shape[1])
+            # k 번째 점수와 같은 제품까지 모두 후보로 두고 (점수 내림차순, product_id 순)으로 자른다.
+            # 열은 product_id 순이므로 같은 점수는 SQL 의 ORDER BY final_score DESC, product_id 와 같은 순서가 된다.
+            kth = -np.partition(-ranked, k - 1, axis=1)[:, k - 1] if k else np.full(len(ranked), np.inf)
+            for i in range(len(ranked)):
+                cols = np.flatnonzero((ranked[i] >= kth[i]) & (ranked[i] > -np.inf))
+                cols = cols[np.lexsort((cols, -ranked[i, cols]))][:k]
+                top[start + i] = [
+                    {"product_id": int(product_ids[c]), "final_score": float(final_score[i, c])} for c in cols
+                ]
+        for i in inverse:
+            yield top[i]
+
+
+class ScoreEngine:
+    """calculate_final_scores 의 CTE 파이프라인을 NumPy 배열 연산으로 계산한다.
+
+    제품 속성과 reviewer_signature_rating 을 한 번 읽어 ScoreSnapshot 으로 만들고
+    ``refresh_seconds`` 가 지나면 다음 요청에서 다시 읽는다.
+    여러 프로필은 (프로필 수 x 제품 수) 행렬로 한 번에 계산한다.
+    """
+
+    def __init__(self, refresh_seconds: float = SCORE_ENGINE_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self.loaded_at = None
+        self._lock = asyncio.Lock()
+        self.snapshot = None
+
+    async def load(self, db: AsyncSession):
+        data_time = (await db.execute(text("SELECT now()"))).scalar()
+        result = await db.execute(text(PRODUCT_QUERY))
+        products = pd.DataFrame(result.fetchall(), columns=result.keys())
+        result = await db.execute(text(SIGNATURE_QUERY))
+        signatures = pd.DataFrame(result.fetchall(), columns=result.keys())
+        self.snapshot = ScoreSnapshot(products, signatures, data_time)
+        self.loaded_at = time.monotonic()
+
+    async def refresh(self, db: AsyncSession):
+        async with self._lock:
+            if self.loaded_at is None or time.monotonic() - self.loaded_at > self.refresh_seconds:
+                await self.load(db)
+
+    def score(self, user_vector) -> pd.DataFrame:
+        return self.snapshot.score(user_vector)
+
+    def top_products_batch(self, user_vectors, top_n=10, chunk_size=256):
+        # 호출한 시점의 스냅샷으로 계산한다 (제너레이터가 나중에 소비되어도 같은 스냅샷)
+        return self.snapshot.top_products_batch(user_vectors, top_n, chunk_size)
+
+    async def calculate_final_scores(self, db: AsyncSession, user_vector) -> pd.DataFrame:
+        await self.refresh(db)
+        return self.score(user_vector)
+
+
+score_engine = ScoreEngine()
@@ -61,6 +61,30 @@ def fetch_review_info(review_id):
     else:
         return None
     
+# 리뷰 검색 결과 페이지 ({"items", "next_cursor", "limit"}) 조회
+def fetch_review_page(url, params=None, cursor=None):
+    params = dict(params or {})
+    if cursor:
+        params["cursor"] = cursor
+    response = requests.get(url, params=params)
+    if response.status_code == 200:
+        return {**response.json(), "url": url, "params": params}
+    # 실패한 요청도 빈 페이지로 저장해서 show_review_page 가 오류를 표시하게 한다
+    return {"items": [], "next_cursor": None, "url": url, "params": params}
+
+# 현재 페이지를 보여주고, 다음 페이지가 있으면 Next Page 버튼으로 이어서 조회
+def show_review_page(key, error_message):
+    result = st.session_state.get(key)
+    if result is None:
+        return
+    if not result["items"]:
+        st.error(error_message)
+        return
+    st.write(pd.DataFrame(result["items"]))
+    if result["next_cursor"] and st.button("Next Page", key=f"{key}_next"):
+        st.session_state[key] = fetch_review_page(result["url"], result["params"], result["next_cursor"])
+        st.rerun()
+
 # 제품 리뷰 통계를 시각화하는 함수
 def plot_review_statistics(df):
     # Star ratios dictionary
@@ -603,13 +627,8 @@ elif page == "Reviews Search":
         with col2:
             keyword = st.text_input("Keyword2")
         if st.button("Search"):
-            response = requests.get(f"{api_url}/reviews/product/{product_name}/keyword/{keyword}")
-            products = response.json()
-            if len(products) != 0:
-                df = pd.DataFrame(products)
-                st.write(df)
-            else:
-                st.error("Failed to search by keyword")
+            st.session_state['keyword_reviews'] = fetch_review_page(f"{api_url}/reviews/product/{product_name}/keyword/{keyword}")
+        show_review_page('keyword_reviews', "Failed to search by keyword")
 
     elif search_type == "By Rating":
         product_id = st.number_input("Product ID", min_value=0, step=1)
@@ -621,13 +640,8 @@ elif page == "Reviews Search":
             st.error("Failed to search product")
         rating = st.slider("Rating", 1, 5)
         if st.button("Search"):
-            response = requests.get(f"{api_url}/reviews/product/{product_id}/{rating}")
-            products = response.json()
-            if len(products) != 0:
-                df = pd.DataFrame(products)
-                st.write(df)
-            else:
-                st.error("Failed to search by rating")
+            st.session_state['rating_reviews'] = fetch_review_page(f"{api_url}/reviews/product/{product_id}/{rating}")
+        show_review_page('rating_reviews', "Failed to search by rating")
 
     elif search_type == "By Date Range":
         col1, col2 = st.columns(2)  
@@ -636,14 +650,8 @@ elif page == "Reviews Search":
         with col2:
             end_date = st.date_input("End Date", datetime(2023, 1, 31))
         if st.button("Search"):
-            response = requests.get(f"{api_url}/reviews/dates/", params={"start_date": start_date, "end_date": end_date})
-            reviews = response.json()
-            if len(reviews) != 0:
-                reviews = response.json()
-                df = pd.DataFrame(reviews)
-                st.write(df)
-            else:
-                st.error("Failed to search by date range")
+            st.session_state['date_reviews'] = fetch_review_page(f"{api_url}/reviews/dates/", {"start_date": start_date, "end_date": end_date})
+        show_review_page('date_reviews', "Failed to search by date range")
 
     elif search_type == "Product Review Statistic":
         product_id = st.number_input("Product ID", min_value=0, step=1)
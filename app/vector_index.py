@@ -0,0 +1,364 @@
+import os
+import json
+import time
+import shutil
+import asyncio
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from .models import EMBEDDING_DIM
+
+# 스냅샷 디렉터리. 지정하지 않으면 인메모리 검색은 비활성화되고 SQL 을 사용한다.
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR")
+SNAPSHOT_KEEP = 2
+# 스냅샷 재생성 검사 주기(초). data_version 이 바뀌었으면 새 스냅샷을 만든다. 0 이면 비활성화.
+VECTOR_INDEX_REBUILD_SECONDS = float(os.getenv("VECTOR_INDEX_REBUILD_SECONDS", "60"))
+
+# 같은 문장에서 읽은 pg_current_snapshot 으로 어떤 트랜잭션이 스냅샷에 포함됐는지 판단한다
+SNAPSHOT_QUERY = """
+SELECT s.db_snapshot, v.*
+FROM (SELECT pg_current_snapshot()::text AS db_snapshot) s
+LEFT JOIN (
+    SELECT
+        p.product_id,
+        p.product_name_embedding,
+        COALESCE(c.review_count, 0) AS review_count,
+        COALESCE(c.used_count, 0) AS used_count,
+        COALESCE(c.embedding_count, 0) AS embedding_count,
+        COALESCE(c.used_embedding_count, 0) AS used_embedding_count,
+        c.embedding_sum,
+        c.used_embedding_sum
+    FROM product p
+    LEFT JOIN product_review_centroid c ON c.product_id = p.product_id
+) v ON true
+ORDER BY v.product_id
+"""
+
+DATA_VERSION_QUERY = "SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM data_version"
+
+COUNT_FIELDS = ["review_count", "used_count", "embedding_count", "used_embedding_count"]
+RESULT_COLUMNS = ['product_id', 'name_similarity', 'review_count', 'used_count', 'avg_similarity', 'avg_similarity_used', 'final_score']
+
+
+def normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def parse_db_snapshot(db_snapshot: str):
+    # 'xmin:xmax:xip1,xip2' 형식
+    xmin, xmax, xip = db_snapshot.split(":")
+    return int(xmin), int(xmax), frozenset(int(xid) for xid in xip.split(",") if xid)
+
+
+def committed_before(xact_id: int, db_snapshot) -> bool:
+    # 커밋된 트랜잭션이 스냅샷에 보이는지 (pg_visible_in_snapshot 과 같은 규칙)
+    xmin, xmax, xip = db_snapshot
+    return xact_id < xmin or (xact_id < xmax and xact_id not in xip)
+
+
+def _stack(vectors):
+    matrix = np.zeros((len(vectors), EMBEDDING_DIM), dtype=np.float32)
+    for i, vector in enumerate(vectors):
+        if vector is not None:
+            matrix[i] = vector
+    return matrix
+
+
+async def build_snapshot(db: AsyncSession, path: str = VECTOR_INDEX_DIR) -> str:
+    """product 임베딩과 review centroid 를 float32 행렬 파일로 저장하고 current 를 교체한다."""
+    # data_version 은 스냅샷보다 먼저 읽어서, 그 사이의 쓰기는 다음 검사에서 다시 반영되게 한다
+    data_version = (await db.execute(text(DATA_VERSION_QUERY))).scalar()
+    result = await db.execute(text(SNAPSHOT_QUERY))
+    rows = result.mappings().all()
+    db_snapshot = rows[0]["db_snapshot"]
+    rows = [row for row in rows if row["product_id"] is not None]
+
+    name_embeddings = [row["product_name_embedding"] for row in rows]
+    arrays = {
+        "product_ids": np.array([row["product_id"] for row in rows], dtype=np.int64),
+        "has_name": np.array([vector is not None for vector in name_embeddings]),
+        "names": _stack([normalize(v) if v is not None else None for v in name_embeddings]),
+        "embedding_sum": _stack([row["embedding_sum"] for row in rows]),
+        "used_embedding_sum": _stack([row["used_embedding_sum"] for row in rows]),
+    }
+    for field in COUNT_FIELDS:
+        arrays[field] = np.array([row[field] for row in rows], dtype=np.int64)
+
+    os.makedirs(path, exist_ok=True)
+    name = f"snapshot-{time.time_ns()}"
+    snapshot_dir = os.path.join(path, name)
+    os.makedirs(snapshot_dir)
+    for key, array in arrays.items():
+        np.save(os.path.join(snapshot_dir, f"{key}.npy"), array)
+    with open(os.path.join(snapshot_dir, "meta.json"), "w") as f:
+        json.dump({"db_snapshot": db_snapshot, "data_version": data_version}, f)
+
+    # current 파일을 원자적으로 교체해서 다른 워커들이 새 스냅샷을 읽게 한다
+    current_tmp = os.path.join(path, "current.tmp")
+    with open(current_tmp, "w") as f:
+        f.write(name)
+    os.replace(current_tmp, os.path.join(path, "current"))
+
+    snapshots = sorted(d for d in os.listdir(path) if d.startswith("snapshot-"))
+    for old in snapshots[:-SNAPSHOT_KEEP]:
+        shutil.rmtree(os.path.join(path, old), ignore_errors=True)
+    return snapshot_dir
+
+
+class ReviewDelta:
+    def __init__(self):
+        self.counts = np.zeros(len(COUNT_FIELDS), dtype=np.int64)
+        self.embedding_sum = np.zeros(EMBEDDING_DIM, dtype=np.float64)
+        self.used_embedding_sum = np.zeros(EMBEDDING_DIM, dtype=np.float64)
+
+
+class VectorIndex:
+    """스냅샷을 memory-map 으로 읽는 인프로세스 semantic search 인덱스.
+
+    여러 uvicorn 워커가 같은 스냅샷 파일의 페이지를 공유하며, 이 프로세스에서 일어난
+    CRUD 변경은 그 트랜잭션이 포함된 스냅샷을 읽을 때까지 델타로 겹쳐서 반영한다.
+    다른 워커의 변경은 주기적인 스냅샷 재생성(run_rebuild_loop)으로 반영된다.
+    """
+
+    def __init__(self, path: str = VECTOR_INDEX_DIR):
+        self.path = path
+        self.snapshot = None
+        self.data_version = None
+        self._db_snapshot = None
+        self._arrays = {}
+        self._rows = {}
+        self._names = {}
+        self._reviews = {}
+        # (xact_id, kind, args) 순서대로 기록한 델타. 스냅샷에 포함되면 버린다.
+        self._deltas = []
+
+    @property
+    def loaded(self) -> bool:
+        return self.snapshot is not None
+
+    @property
+    def version(self):
+        # 검색 결과가 달라지는 시점마다 바뀌는 값 (스냅샷 + 이 프로세스에서 겹친 델타 수)
+        return self.snapshot, len(self._deltas)
+
+    def _current(self):
+        try:
+            with open(os.path.join(self.path, "current")) as f:
+                return f.read().strip()
+        except (OSError, TypeError):
+            return None
+
+    def load(self) -> bool:
+        current = self._current()
+        if current is None:
+            return False
+        snapshot_dir = os.path.join(self.path, current)
+        self._arrays = {
+            file[:-4]: np.load(os.path.join(snapshot_dir, file), mmap_mode="r")
+            for file in os.listdir(snapshot_dir)
+            if file.endswith(".npy")
+        }
+        self._rows = {
+            int(product_id): i for i, product_id in enumerate(self._arrays["product_ids"])
+        }
+        try:
+            with open(os.path.join(snapshot_dir, "meta.json")) as f:
+                meta = json.load(f)
+            self._db_snapshot = parse_db_snapshot(meta["db_snapshot"])
+            self.data_version = meta["data_version"]
+            # 새 스냅샷에 아직 포함되지 않은 트랜잭션의 델타만 다시 겹친다
+            self._deltas = [
+                delta for delta in self._deltas
+                if not committed_before(delta[0], self._db_snapshot)
+            ]
+        except OSError:
+            # meta 가 없는 이전 형식의 스냅샷
+            self._db_snapshot = None
+            self.data_version = None
+            self._deltas = []
+        self._names = {}
+        self._reviews = {}
+        for _, kind, args in self._deltas:
+            getattr(self, kind)(*args)
+        self.snapshot = current
+        return True
+
+    def refresh(self) -> bool:
+        # 다른 프로세스가 새 스냅샷을 만들었으면 다시 로드
+        current = self._current()
+        if current is not None and current != self.snapshot:
+            return self.load()
+        return self.loaded
+
+    def needs_rebuild(self, data_version) -> bool:
+        # 스냅샷 이후 쓰기가 있었거나, 스냅샷 시점에 진행 중이던 쓰기 트랜잭션이 있었으면 다시 만든다
+        return (
+            not self.loaded
+            or self._db_snapshot is None
+            or data_version != self.data_version
+            or bool(self._db_snapshot[2])
+        )
+
+    async def rebuild_if_changed(self, db: AsyncSession) -> bool:
+        self.refresh()
+        data_version = (await db.execute(text(DATA_VERSION_QUERY))).scalar()
+        if not self.needs_rebuild(data_version):
+            return False
+        await build_snapshot(db, self.path)
+        return self.load()
+
+    async def run_rebuild_loop(self, session_factory, interval: float = VECTOR_INDEX_REBUILD_SECONDS):
+        # 각 워커의 델타는 자기 프로세스에만 보이므로, 주기적으로 스냅샷을 다시 만들어 워커 간 결과를 맞춘다
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                async with session_factory() as db:
+                    await self.rebuild_if_changed(db)
+            except Exception as e:
+                print(f"Vector index rebuild failed: {e}")
+
+    # CRUD 델타
+    async def transaction_id(self, db: AsyncSession):
+        # 커밋 전에 호출해서 쓰기 트랜잭션의 ID 를 얻는다 (인덱스를 쓰지 않으면 None)
+        if not self.loaded:
+            return None
+        return int((await db.execute(text("SELECT pg_current_xact_id()::text"))).scalar())
+
+    def _record(self, xact_id, kind, args):
+        # 커밋이 끝난 뒤에만 호출한다
+        if xact_id is None or not self.loaded:
+            return
+        self._deltas.append((xact_id, kind, args))
+        getattr(self, kind)(*args)
+
+    def apply_product(self, xact_id, product_id: int, name_embedding):
+        # name_embedding 이 None 이면 삭제된 제품
+        if name_embedding is not None:
+            name_embedding = normalize(name_embedding)
+        self._record(xact_id, "_apply_product", (product_id, name_embedding))
+
+    def apply_review(self, xact_id, product_id: int, used_over_one_month, embedding, sign: int = 1):
+        # 리뷰 추가는 sign=1, 삭제는 sign=-1 (수정은 삭제 + 추가)
+        if embedding is not None:
+            embedding = normalize(embedding)
+        self._record(xact_id, "_apply_review", (product_id, bool(used_over_one_month), embedding, sign))
+
+    def _apply_product(self, product_id, name_embedding):
+        self._names[product_id] = name_embedding
+        if name_embedding is None:
+            self._reviews.pop(product_id, None)
+
+    def _apply_review(self, product_id, used, embedding, sign):
+        delta = self._reviews.setdefault(product_id, ReviewDelta())
+        has_embedding = embedding is not None
+        delta.counts += sign * np.array(
+            [1, used, has_embedding, used and has_embedding], dtype=np.int64
+        )
+        if has_embedding:
+            term = sign * embedding
+            delta.embedding_sum += term
+            if used:
+                delta.used_embedding_sum += term
+
+    def search(self, query_embedding, alpha=1.0, beta=1.0, gamma=1.5, top_n=None, candidate_ids=None) -> pd.DataFrame:
+        a = self._arrays
+        q = normalize(query_embedding)
+
+        product_ids = np.asarray(a["product_ids"])
+        has_name = np.array(a["has_name"])
+        # 내적은 mmap 된 float32 행렬 그대로 계산하고 (행렬을 float64 로 복사하지 않는다)
+        # 제품 수 길이의 결과 벡터만 float64 로 바꿔 평균/점수를 계산한다
+        name_dot = (a["names"] @ q).astype(np.float64)
+        sum_dot = (a["embedding_sum"] @ q).astype(np.float64)
+        used_sum_dot = (a["used_embedding_sum"] @ q).astype(np.float64)
+        counts = np.stack([np.asarray(a[field]) for field in COUNT_FIELDS], axis=1)
+
+        # 스냅샷 이후 변경분 반영 (스냅샷에 없는 새 제품은 뒤에 붙인다)
+        touched = set(self._names) | set(self._reviews)
+        new_ids = [pid for pid in touched if pid not in self._rows]
+        if new_ids:
+            extra = len(new_ids)
+            product_ids = np.concatenate([product_ids, np.array(new_ids, dtype=np.int64)])
+            has_name = np.concatenate([has_name, np.zeros(extra, dtype=bool)])
+            name_dot = np.concatenate([name_dot, np.zeros(extra)])
+            sum_dot = np.concatenate([sum_dot, np.zeros(extra)])
+            used_sum_dot = np.concatenate([used_sum_dot, np.zeros(extra)])
+            counts = np.concatenate([counts, np.zeros((extra, len(COUNT_FIELDS)), dtype=np.int64)])
+        rows = dict(self._rows)
+        rows.update({pid: len(self._rows) + i for i, pid in enumerate(new_ids)})
+
+        deleted = np.zeros(len(product_ids), dtype=bool)
+        for pid, name in self._names.items():
+            i = rows[pid]
+            if name is None:
+                deleted[i] = True
+            else:
+                has_name[i] = True
+                name_dot[i] = name @ q
+        for pid, delta in self._reviews.items():
+            i = rows[pid]
+            counts[i] += delta.counts
+            sum_dot[i] += delta.embedding_sum @ q
+            used_sum_dot[i] += delta.used_embedding_sum @ q
+
+        review_count, used_count, embedding_count, used_embedding_count = counts.T
+        with np.errstate(divide="ignore", invalid="ignore"):
+            name_similarity = np.where(has_name, name_dot, np.nan)
+            avg_similarity = np.where(embedding_count > 0, sum_dot / embedding_count, np.nan)
+            avg_similarity_used = np.where(used_embedding_count > 0, used_sum_dot / used_embedding_count, np.nan)
+        used_term = np.nan_to_num(avg_similarity_used * gamma)
+        final_score = np.where(
+            review_count >= 3,
+            (name_similarity * alpha + avg_similarity * beta + used_term) / (1 + gamma + used_count * gamma),
+            (name_similarity * alpha + avg_similarity * beta) / (1 + alpha + beta),
+        )
+
+        mask = (review_count > 0) & ~deleted
+        if candidate_ids is not None:
+            mask &= np.isin(product_ids, np.asarray(list(candidate_ids), dtype=np.int64))
+        idx = np.flatnonzero(mask)
+        ranked = np.nan_to_num(final_score[idx], nan=-np.inf)
+        if top_n is not None and top_n < len(idx):
+            # argpartition 으로 상위 top_n 만 고르고, 경계 점수와 같은 제품까지 포함해 정렬한다
+            top = np.argpartition(-ranked, top_n - 1)[:top_n] if top_n > 0 else np.empty(0, dtype=np.intp)
+            kth = ranked[top].min() if top_n > 0 else np.inf
+            keep = np.flatnonzero(ranked >= kth)
+            idx, ranked = idx[keep], ranked[keep]
+        # 점수가 같으면 product_id 순 (SQL 의 ORDER BY final_score DESC, product_id 와 같은 순서)
+        idx = idx[np.lexsort((product_ids[idx], -ranked))]
+        if top_n is not None:
+            idx = idx[:top_n]
+
+        return pd.DataFrame(
+            {
+                "product_id": product_ids[idx],
+                "name_similarity": name_similarity[idx],
+                "review_count": review_count[idx],
+                "used_count": used_count[idx],
+                "avg_similarity": avg_similarity[idx],
+                "avg_similarity_used": np.nan_to_num(avg_similarity_used[idx]),
+                "final_score": final_score[idx],
+            },
+            columns=RESULT_COLUMNS,
+        )
+
+
+vector_index = VectorIndex()
+
+
+async def _build_from_cli(path):
+    from .database import SessionLocal, engine
+
+    async with SessionLocal() as db:
+        print(await build_snapshot(db, path))
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    # python -m app.vector_index [snapshot dir]
+    import sys
+
+    asyncio.run(_build_from_cli(sys.argv[1] if len(sys.argv) > 1 else VECTOR_INDEX_DIR))
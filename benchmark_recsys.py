@@ -0,0 +1,137 @@
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import time
+from app import recsys
+from app.cache import result_cache
+from app.database import SessionLocal, engine
+
+# 사용법: python benchmark_recsys.py --iterations 50 --query "선물하기 좋은 토너" [--result-cache]
+#         python benchmark_recsys.py --check-scoring  (SQL 과 score_engine 의 결과만 비교)
+USER_VECTOR = {
+    "reviewer_id": -1,
+    "skin_type_oily": True,
+    "skin_concern_excess_sebum": False,
+    "skin_type_trouble_prone": False,
+    "skin_type_sensitive": True,
+    "skin_concern_trouble": False,
+    "skin_concern_atopy": False,
+    "skin_type_combination": True,
+    "skin_type_normal": False,
+    "skin_concern_whitening": True,
+    "skin_concern_wrinkles": False,
+    "skin_type_dry": False,
+    "skin_type_mildly_dry": False,
+}
+
+
+async def measure(name, iterations, func):
+    # 첫 호출(연결, 모델 로드 등)은 제외하고 측정
+    await func()
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await func()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    p95 = timings[max(0, int(len(timings) * 0.95) - 1)]
+    print(f"{name:<32} p50 {statistics.median(timings):8.2f} ms   p95 {p95:8.2f} ms")
+
+
+# SQL 과 NumPy 점수를 같다고 볼 오차 (float 연산 순서 차이)
+SCORE_TOLERANCE = 1e-9
+
+
+def sample_profiles(count=32, seed=0):
+    # USER_VECTOR 와 고정 시드의 무작위 프로필
+    rng = random.Random(seed)
+    profiles = [USER_VECTOR]
+    for i in range(count - 1):
+        profiles.append(
+            {"reviewer_id": -1, **{field: rng.random() < 0.5 for field in recsys.USER_VECTOR_FIELDS}}
+        )
+    return profiles
+
+
+def compare_rankings(sql_df, numpy_df):
+    # 점수 차이가 허용 오차를 넘는 제품과, 같은 점수가 아닌데 순서가 다른 위치를 찾는다
+    problems = []
+    # SQL 결과의 점수는 numeric(Decimal) 일 수 있으므로 float 로 맞춘다
+    sql_df = sql_df.astype({"final_score": float})
+    numpy_df = numpy_df.astype({"final_score": float})
+    sql_scores = dict(zip(sql_df["product_id"], sql_df["final_score"]))
+    numpy_scores = dict(zip(numpy_df["product_id"], numpy_df["final_score"]))
+    for product_id in sql_scores.keys() ^ numpy_scores.keys():
+        problems.append(f"product {product_id} only in {'sql' if product_id in sql_scores else 'numpy'}")
+    for product_id in sql_scores.keys() & numpy_scores.keys():
+        if abs(sql_scores[product_id] - numpy_scores[product_id]) > SCORE_TOLERANCE:
+            problems.append(
+                f"product {product_id} score sql={sql_scores[product_id]} numpy={numpy_scores[product_id]}"
+            )
+    for rank, (sql_row, numpy_row) in enumerate(
+        zip(sql_df[["product_id", "final_score"]].itertuples(index=False),
+            numpy_df[["product_id", "final_score"]].itertuples(index=False))
+    ):
+        if sql_row.product_id != numpy_row.product_id and abs(sql_row.final_score - numpy_row.final_score) > SCORE_TOLERANCE:
+            problems.append(f"rank {rank}: sql={sql_row.product_id} numpy={numpy_row.product_id}")
+    return problems
+
+
+async def check_scoring(db, profiles):
+    # calculate_final_scores 의 SQL 경로와 score_engine(numpy) 경로가 같은 순위를 내는지 확인
+    mismatched = 0
+    for profile in profiles:
+        sql_df = await recsys.calculate_final_scores(db, profile, "sql")
+        numpy_df = await recsys.calculate_final_scores(db, profile, "numpy")
+        problems = compare_rankings(sql_df, numpy_df)
+        if problems:
+            mismatched += 1
+            print(f"profile {recsys.profile_bitmask(recsys.user_vector_params(profile))}: {len(problems)} mismatches")
+            for problem in problems[:10]:
+                print(f"  {problem}")
+    print(f"sql vs numpy scoring: {mismatched} of {len(profiles)} profiles differ")
+    return mismatched
+
+
+async def main(iterations, query, use_result_cache=False, check_only=False):
+    if not use_result_cache:
+        # 결과 캐시가 켜져 있으면 첫 호출 이후로는 캐시 hit 만 측정하게 된다
+        result_cache.memory.maxsize = 0
+    async with SessionLocal() as db:
+        # 두 점수 계산 경로가 어긋나면 측정 전에 알린다 (비교 중에는 결과 캐시를 쓰지 않는다)
+        maxsize, result_cache.memory.maxsize = result_cache.memory.maxsize, 0
+        mismatched = await check_scoring(db, sample_profiles())
+        result_cache.memory.maxsize = maxsize
+        if check_only:
+            await engine.dispose()
+            return mismatched
+        await measure(
+            "calculate_final_scores (recsys2)",
+            iterations,
+            lambda: recsys.calculate_final_scores(db, USER_VECTOR),
+        )
+        await measure(
+            "get_final_recommendations (1)",
+            iterations,
+            lambda: recsys.get_final_recommendations(db, USER_VECTOR, query),
+        )
+        await measure(
+            "get_top_products_by_similarity",
+            iterations,
+            lambda: recsys.get_top_products_by_similarity(db, query, top_n=10),
+        )
+    await engine.dispose()
+    return mismatched
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--query", default="선물하기 좋은 토너")
+    parser.add_argument("--result-cache", action="store_true", help="결과 캐시를 켠 상태로 측정")
+    parser.add_argument("--check-scoring", action="store_true", help="SQL 과 numpy 점수 비교만 실행 (다르면 종료 코드 1)")
+    args = parser.parse_args()
+    mismatched = asyncio.run(main(args.iterations, args.query, args.result_cache, args.check_scoring))
+    sys.exit(1 if mismatched else 0)
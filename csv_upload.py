@@ -1,59 +1,514 @@
-import psycopg2
-import csv
+import os
+import time
+import hashlib
+import asyncio
+import argparse
+import multiprocessing
 import numpy as np
+import pandas as pd
+from sqlalchemy import text, Boolean, Integer, BigInteger, Float, DateTime
+from app import models, migrations
+from app.database import engine
+from app.embedding import MODEL_NAME, _encode_in_worker, create_executor
+from app.models import EMBEDDING_DIM
 
-# Establishing the connection
-conn = psycopg2.connect(
-   database="", user='postgres', password='', host='localhost', port='5432'
-)
-
-# Setting auto commit false
-conn.autocommit = False
-
-# Creating a cursor object using the cursor() method
-cursor = conn.cursor()
-
-def replace_empty_with_none(row):
-    return [None if x == '' else x for x in row]
-
-with open('./csv/reviewer.csv', 'r', encoding='utf-8') as f:
-    reader = csv.reader(f)
-    next(reader) # Skip the header row.
-    for row in reader:
-        cursor.execute(
-        "INSERT INTO reviewer (reviewer_id, reviewer_name, skin_concern_keratin, skin_concern_pores, skin_concern_blackheads, \
-            skin_concern_excess_sebum, personal_color_spring_warm, personal_color_cool, skin_type_trouble_prone, skin_type_oily, \
-            personal_color_autumn_warm, skin_type_sensitive, skin_concern_whitening, skin_concern_redness, skin_concern_wrinkles, \
-            skin_type_dry, personal_color_winter_cool, skin_type_mildly_dry, skin_concern_trouble, skin_type_combination, \
-            skin_concern_dark_circles, skin_concern_elasticity, skin_type_normal, skin_concern_atopy, personal_color_summer_cool, \
-            skin_concern_spots, personal_color_warm) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, \
-            %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)", row)
-
-with open('./csv/product.csv', 'r', encoding='utf-8') as f:
-    reader = csv.reader(f)
-    next(reader) # Skip the header row.
-    for row in reader:
-        row = replace_empty_with_none(row)
-        row[-1] = eval(row[-1]) # embedding
-        cursor.execute(
-        "INSERT INTO product (product_id, product_name, product_category, brand_name, original_price, final_price, number_of_reviews, \
-            review_rating, review_5_star_ratio, review_4_star_ratio, review_3_star_ratio, review_2_star_ratio, review_1_star_ratio, \
-            skin_type_dry, skin_type_combination, skin_type_oily, skin_concern_moisturizing, skin_concern_soothing, \
-            skin_concern_wrinkles_whitening, cleansing_power_very_satisfied, cleansing_power_average, cleansing_power_somewhat_disappointed, \
-            spreadability_very_satisfied, spreadability_average, spreadability_somewhat_disappointed, irritation_level_not_irritating, \
-            irritation_level_average, irritation_level_irritating, product_name_embedding) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, \
-            %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)", row)
-
-with open('./csv/review.csv', 'r', encoding='utf-8') as f:
-    reader = csv.reader(f)
-    next(reader) # Skip the header row.
-    for row in reader:
-        row = replace_empty_with_none(row)
-        row[-1] = eval(row[-1]) # embedding
-        cursor.execute(
-        "INSERT INTO review (review_id, product_id, reviewer_id, product_name, reviewer_name, rating, used_over_one_month, repurchase_intention, \
-            skin_type_review, skin_concern_review, irritation_level_review, cleansing_power_review, spreadability_review, review_content, \
-            review_date, review_content_embedding) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)", row)
-
-
-conn.commit()
\ No newline at end of file
+# 사용법: python csv_upload.py --csv-dir ./csv [--defer-indexes] [--embed] [--mode sync]
+# reviewer/product 를 먼저 병렬로 적재하고 review 를 적재한다 (FK 순서).
+# 각 테이블은 binary COPY (asyncpg copy_records_to_table) 로 한 트랜잭션에서 적재한다.
+
+TABLE_COLUMNS = {
+    "reviewer": [
+        "reviewer_id", "reviewer_name", "skin_concern_keratin", "skin_concern_pores", "skin_concern_blackheads",
+        "skin_concern_excess_sebum", "personal_color_spring_warm", "personal_color_cool", "skin_type_trouble_prone", "skin_type_oily",
+        "personal_color_autumn_warm", "skin_type_sensitive", "skin_concern_whitening", "skin_concern_redness", "skin_concern_wrinkles",
+        "skin_type_dry", "personal_color_winter_cool", "skin_type_mildly_dry", "skin_concern_trouble", "skin_type_combination",
+        "skin_concern_dark_circles", "skin_concern_elasticity", "skin_type_normal", "skin_concern_atopy", "personal_color_summer_cool",
+        "skin_concern_spots", "personal_color_warm",
+    ],
+    "product": [
+        "product_id", "product_name", "product_category", "brand_name", "original_price", "final_price", "number_of_reviews",
+        "review_rating", "review_5_star_ratio", "review_4_star_ratio", "review_3_star_ratio", "review_2_star_ratio", "review_1_star_ratio",
+        "skin_type_dry", "skin_type_combination", "skin_type_oily", "skin_concern_moisturizing", "skin_concern_soothing",
+        "skin_concern_wrinkles_whitening", "cleansing_power_very_satisfied", "cleansing_power_average", "cleansing_power_somewhat_disappointed",
+        "spreadability_very_satisfied", "spreadability_average", "spreadability_somewhat_disappointed", "irritation_level_not_irritating",
+        "irritation_level_average", "irritation_level_irritating", "product_name_embedding",
+    ],
+    "review": [
+        "review_id", "product_id", "reviewer_id", "product_name", "reviewer_name", "rating", "used_over_one_month", "repurchase_intention",
+        "skin_type_review", "skin_concern_review", "irritation_level_review", "cleansing_power_review", "spreadability_review", "review_content",
+        "review_date", "review_content_embedding",
+    ],
+}
+
+# FK 순서. 같은 단계의 테이블은 동시에 적재한다.
+LOAD_STAGES = [["reviewer", "product"], ["review"]]
+CHUNK_SIZE = int(os.getenv("CSV_UPLOAD_CHUNK_SIZE", "20000"))
+
+# --embed: CSV 에 임베딩이 없을 때 이 텍스트 컬럼으로 직접 계산한다
+EMBEDDING_TEXT_COLUMNS = {
+    "product_name_embedding": "product_name",
+    "review_content_embedding": "review_content",
+}
+EMBED_BATCH_SIZE = int(os.getenv("CSV_UPLOAD_EMBED_BATCH_SIZE", "64"))
+EMBED_WORKERS = int(os.getenv("CSV_UPLOAD_EMBED_WORKERS", "2"))
+
+TRUE_VALUES = {"true", "t", "1", "1.0", "yes", "y"}
+FALSE_VALUES = {"false", "f", "0", "0.0", "no", "n"}
+
+
+def parse_embeddings(values: pd.Series) -> list:
+    """'[0.1, 0.2, ...]' 문자열들을 청크 단위로 한 번에 float32 배열로 파싱한다 (eval 대신)."""
+    result = [None] * len(values)
+    present = values.notna().to_numpy()
+    if present.any():
+        joined = ",".join(values[present].str.strip().str.strip("[]"))
+        matrix = np.fromstring(joined, sep=",", dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        for i, vector in zip(np.flatnonzero(present), matrix):
+            result[i] = vector
+    return result
+
+
+def _to_objects(series: pd.Series) -> list:
+    # NaN/NaT 는 None 으로 (COPY 에서 NULL)
+    return series.astype(object).where(series.notna(), None).tolist()
+
+
+def convert_column(values: pd.Series, column) -> list:
+    column_type = column.type
+    if isinstance(column_type, models.Vector):
+        return parse_embeddings(values)
+    if isinstance(column_type, Boolean):
+        lowered = values.str.strip().str.lower()
+        return _to_objects(lowered.map(lambda v: True if v in TRUE_VALUES else False if v in FALSE_VALUES else None))
+    if isinstance(column_type, (Integer, BigInteger)):
+        return _to_objects(pd.to_numeric(values, errors="coerce").astype("Int64"))
+    if isinstance(column_type, Float):
+        return _to_objects(pd.to_numeric(values, errors="coerce"))
+    if isinstance(column_type, DateTime):
+        return _to_objects(pd.to_datetime(values, errors="coerce"))
+    return _to_objects(values)
+
+
+def convert_chunk(table: str, chunk: pd.DataFrame, embeddings=None) -> list:
+    # embeddings: 직접 계산한 임베딩 컬럼 {컬럼 이름: 벡터 목록}
+    embeddings = embeddings or {}
+    table_columns = models.Base.metadata.tables[table].columns
+    columns = [
+        embeddings[name] if name in embeddings else convert_column(chunk[name], table_columns[name])
+        for name in TABLE_COLUMNS[table]
+    ]
+    return list(zip(*columns))
+
+
+def csv_columns(table: str, embed: bool = False) -> list:
+    # --embed 이면 CSV 에 임베딩 컬럼이 없다고 보고 앞쪽 컬럼만 읽는다
+    return [name for name in TABLE_COLUMNS[table] if not (embed and name in EMBEDDING_TEXT_COLUMNS)]
+
+
+def read_csv_chunks(path: str, columns: list, chunk_size: int = CHUNK_SIZE, skip_rows: int = 0):
+    # 모든 값을 문자열로 읽고 빈 문자열은 NULL 로 처리
+    return pd.read_csv(
+        path, header=0, names=columns, usecols=range(len(columns)), dtype=str, keep_default_na=False,
+        na_values=[""], chunksize=chunk_size, encoding="utf-8", skiprows=range(1, skip_rows + 1),
+    )
+
+
+class ChunkEmbedder:
+    """청크의 텍스트를 길이순으로 정렬한 뒤 배치로 나눠 워커 프로세스들에서 임베딩한다.
+
+    비슷한 길이의 문장끼리 같은 배치에 들어가므로 패딩으로 버려지는 연산이 줄어든다.
+    """
+
+    def __init__(self, workers: int = EMBED_WORKERS, batch_size: int = EMBED_BATCH_SIZE, model_name: str = MODEL_NAME):
+        self.batch_size = batch_size
+        self._executor = create_executor(
+            "process", workers, model_name, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    async def encode(self, texts: pd.Series) -> list:
+        # NULL 텍스트는 임베딩도 NULL
+        result = [None] * len(texts)
+        values = texts.to_numpy()
+        present = np.flatnonzero(texts.notna().to_numpy())
+        order = present[np.argsort(texts.str.len().to_numpy()[present], kind="stable")]
+        batches = [order[start:start + self.batch_size] for start in range(0, len(order), self.batch_size)]
+
+        loop = asyncio.get_running_loop()
+        outputs = await asyncio.gather(*(
+            loop.run_in_executor(self._executor, _encode_in_worker, values[batch].tolist(), self.batch_size)
+            for batch in batches
+        ))
+        for batch, embeddings in zip(batches, outputs):
+            for i, embedding in zip(batch, embeddings):
+                result[i] = np.asarray(embedding, dtype=np.float32)
+        return result
+
+    def shutdown(self):
+        self._executor.shutdown(cancel_futures=True)
+
+
+async def prepare_chunk(table: str, chunks, embedder: ChunkEmbedder = None):
+    chunk = await asyncio.to_thread(next, chunks, None)
+    if chunk is None:
+        return None, None
+    embeddings = {}
+    if embedder is not None:
+        for column, source in EMBEDDING_TEXT_COLUMNS.items():
+            if column in TABLE_COLUMNS[table]:
+                embeddings[column] = await embedder.encode(chunk[source])
+    records = await asyncio.to_thread(convert_chunk, table, chunk, embeddings)
+    return chunk, records
+
+
+CHECKPOINT_QUERY = "SELECT rows_done FROM upload_checkpoint WHERE table_name = $1 AND csv_path = $2"
+
+SAVE_CHECKPOINT_QUERY = """
+INSERT INTO upload_checkpoint (table_name, csv_path, rows_done, updated_at)
+VALUES ($1, $2, $3, now())
+ON CONFLICT (table_name, csv_path) DO UPDATE
+SET rows_done = EXCLUDED.rows_done, updated_at = EXCLUDED.updated_at
+"""
+
+
+async def copy_chunks(conn, table: str, chunks, on_chunk=None, embedder=None, checkpoint=None) -> int:
+    """CSV 청크를 변환/임베딩하면서 COPY 로 보낸다. 적재한 행 수를 반환한다.
+
+    checkpoint=(csv_path, 이미 적재한 행 수) 이면 청크마다 COPY 와 진행 위치를 한 트랜잭션으로 커밋한다.
+    """
+    rows = 0
+    pending = asyncio.create_task(prepare_chunk(table, chunks, embedder))
+    try:
+        while True:
+            chunk, records = await pending
+            if chunk is None:
+                return rows
+            # 다음 청크의 읽기/변환/임베딩을 현재 청크의 COPY 와 겹쳐서 실행
+            pending = asyncio.create_task(prepare_chunk(table, chunks, embedder))
+            if checkpoint is None:
+                await conn.copy_records_to_table(table, records=records, columns=TABLE_COLUMNS[table])
+            else:
+                csv_path, rows_done = checkpoint
+                async with conn.transaction():
+                    await conn.copy_records_to_table(table, records=records, columns=TABLE_COLUMNS[table])
+                    await conn.execute(SAVE_CHECKPOINT_QUERY, table, csv_path, rows_done + rows + len(records))
+            rows += len(records)
+            if on_chunk is not None:
+                on_chunk(chunk)
+    finally:
+        pending.cancel()
+
+
+async def load_table(table: str, path: str, chunk_size: int = CHUNK_SIZE, on_chunk=None, embedder=None) -> int:
+    start = time.perf_counter()
+    async with engine.connect() as conn:
+        driver = (await conn.get_raw_connection()).driver_connection
+        if embedder is None:
+            chunks = iter(read_csv_chunks(path, csv_columns(table), chunk_size))
+            async with driver.transaction():
+                rows = await copy_chunks(driver, table, chunks, on_chunk)
+        else:
+            # 임베딩 계산은 오래 걸리므로 청크 단위로 커밋하고, 중단되면 마지막 커밋 위치부터 이어서 적재한다
+            csv_path = os.path.abspath(path)
+            rows_done = await driver.fetchval(CHECKPOINT_QUERY, table, csv_path) or 0
+            if rows_done:
+                print(f"{table}: resuming after {rows_done} rows")
+            chunks = iter(read_csv_chunks(path, csv_columns(table, embed=True), chunk_size, rows_done))
+            rows = await copy_chunks(driver, table, chunks, on_chunk, embedder, (csv_path, rows_done))
+    elapsed = time.perf_counter() - start
+    print(f"{table}: {rows} rows in {elapsed:.1f}s ({rows / elapsed:.0f} rows/s)")
+    return rows
+
+
+SECONDARY_INDEXES_QUERY = """
+SELECT i.relname, pg_get_indexdef(i.oid)
+FROM pg_index x
+JOIN pg_class i ON i.oid = x.indexrelid
+JOIN pg_class t ON t.oid = x.indrelid
+WHERE t.relname = ANY(:tables)
+  AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid)
+"""
+
+
+async def defer_indexes_and_triggers(tables) -> list:
+    # 제약조건이 아닌 인덱스를 삭제하고 사용자 트리거를 끈다. 다시 만들 인덱스 정의를 반환한다.
+    async with engine.begin() as conn:
+        result = await conn.execute(text(SECONDARY_INDEXES_QUERY), {"tables": list(tables)})
+        indexes = result.fetchall()
+        for name, _ in indexes:
+            await conn.execute(text(f'DROP INDEX IF EXISTS "{name}"'))
+        for table in tables:
+            await conn.execute(text(f"ALTER TABLE {table} DISABLE TRIGGER USER"))
+    return [definition for _, definition in indexes]
+
+
+async def restore_indexes_and_triggers(tables, index_definitions, review_counts):
+    async with engine.begin() as conn:
+        for definition in index_definitions:
+            await conn.execute(text(definition))
+        for table in tables:
+            await conn.execute(text(f"ALTER TABLE {table} ENABLE TRIGGER USER"))
+
+        # 트리거가 하던 일을 한 번에 처리: 파생 테이블 재계산, 제품 리뷰 통계, 추천/캐시 무효화
+        await migrations.rebuild_product_review_centroids(conn)
+        await migrations.rebuild_reviewer_signature_ratings(conn)
+        await migrations.rebuild_product_review_stats(conn)
+        if review_counts:
+            await conn.execute(
+                text(
+                    """
+                    SELECT apply_product_review_stats(d.product_id, d.reviews, 0, 0, 0, 0, 0, 0, 0)
+                    FROM unnest(CAST(:product_ids AS integer[]), CAST(:reviews AS integer[])) AS d(product_id, reviews)
+                    """
+                ),
+                {
+                    "product_ids": [int(product_id) for product_id in review_counts],
+                    "reviews": [int(count) for count in review_counts.values()],
+                },
+            )
+        await conn.execute(text("UPDATE reviewer_recommendation SET stale_at = now() WHERE stale_at IS NULL OR stale_at < now()"))
+        await conn.execute(text("SELECT nextval('data_version')"))
+
+
+async def reset_sequences(tables):
+    # 명시적인 id 로 적재했으므로 시퀀스를 최대값 다음으로 맞춘다
+    async with engine.begin() as conn:
+        for table in tables:
+            key = TABLE_COLUMNS[table][0]
+            await conn.execute(
+                text(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', '{key}'), "
+                    f"COALESCE((SELECT MAX({key}) FROM {table}), 0) + 1, false)"
+                )
+            )
+
+
+SYNC_HASHES_QUERY = "SELECT row_id, row_hash FROM sync_row_hash WHERE table_name = $1"
+
+SAVE_SYNC_HASHES_QUERY = """
+INSERT INTO sync_row_hash (table_name, row_id, row_hash)
+SELECT $1, t.row_id, t.row_hash FROM unnest($2::integer[], $3::text[]) AS t(row_id, row_hash)
+ON CONFLICT (table_name, row_id) DO UPDATE SET row_hash = EXCLUDED.row_hash
+"""
+
+DELETE_SYNC_HASHES_QUERY = "DELETE FROM sync_row_hash WHERE table_name = $1 AND row_id = ANY($2::integer[])"
+
+
+def row_hashes(chunk: pd.DataFrame, columns: list) -> list:
+    # 임베딩을 제외한 CSV 값을 구분자로 이어 붙인 문자열의 md5
+    joined = chunk[columns[0]].fillna("\\N")
+    for name in columns[1:]:
+        joined = joined + "\x1f" + chunk[name].fillna("\\N")
+    return [hashlib.md5(value.encode("utf-8")).hexdigest() for value in joined]
+
+
+async def stage_sync_table(conn, table: str, path: str, chunk_size: int = CHUNK_SIZE, embedder=None) -> dict:
+    """CSV 행 해시를 지난 동기화 때의 해시와 비교해 새로 생기거나 바뀐 행만 임시 테이블 stage_<table> 에 적재한다.
+
+    embedder 가 있으면 텍스트가 바뀐 행만 임베딩을 다시 계산한다 (나머지는 NULL 로 두고 기존 값을 유지).
+    """
+    key = TABLE_COLUMNS[table][0]
+    columns = csv_columns(table, embed=embedder is not None)
+    hashed_columns = [name for name in columns if name not in EMBEDDING_TEXT_COLUMNS]
+    stored = {row["row_id"]: row["row_hash"] for row in await conn.fetch(SYNC_HASHES_QUERY, table)}
+    if not stored:
+        # 첫 동기화: --mode load 로 적재된 기존 행을 해시 없이 기록된 것으로 본다.
+        # CSV 에 있는 행은 한 번 다시 반영하면서 해시를 남기고, CSV 에 없는 행은 삭제한다.
+        stored = dict.fromkeys(row[key] for row in await conn.fetch(f"SELECT {key} FROM {table}"))
+
+    await conn.execute(f"DROP TABLE IF EXISTS stage_{table}")
+    await conn.execute(f"CREATE TEMP TABLE stage_{table} (LIKE {table})")
+    seen, changed_ids, changed_hashes, embedded = set(), [], [], 0
+    for chunk in read_csv_chunks(path, columns, chunk_size):
+        ids = pd.to_numeric(chunk[key]).astype("int64").tolist()
+        hashes = row_hashes(chunk, hashed_columns)
+        seen.update(ids)
+        mask = np.array([stored.get(row_id) != row_hash for row_id, row_hash in zip(ids, hashes)], dtype=bool)
+        if not mask.any():
+            continue
+        changed = chunk[mask]
+        changed_ids += [row_id for row_id, m in zip(ids, mask) if m]
+        changed_hashes += [row_hash for row_hash, m in zip(hashes, mask) if m]
+
+        embeddings = {}
+        if embedder is not None:
+            chunk_ids = changed_ids[len(changed_ids) - len(changed):]
+            for column, source in EMBEDDING_TEXT_COLUMNS.items():
+                if column not in TABLE_COLUMNS[table]:
+                    continue
+                current = dict(await conn.fetch(
+                    f"SELECT {key}, {source} FROM {table} WHERE {key} = ANY($1::integer[])", chunk_ids
+                ))
+                unchanged = [row_id in current and current[row_id] == value for row_id, value in zip(chunk_ids, changed[source])]
+                texts = changed[source].mask(unchanged)
+                embeddings[column] = await embedder.encode(texts)
+                embedded += int(texts.notna().sum())
+
+        records = convert_chunk(table, changed, embeddings)
+        await conn.copy_records_to_table(f"stage_{table}", records=records, columns=TABLE_COLUMNS[table])
+
+    return {
+        "rows": len(seen),
+        "new": sum(row_id not in stored for row_id in changed_ids),
+        "changed_ids": changed_ids,
+        "changed_hashes": changed_hashes,
+        "removed_ids": sorted(set(stored) - seen),
+        "embedded": embedded,
+    }
+
+
+def upsert_from_stage_sql(table: str) -> str:
+    key, *columns = TABLE_COLUMNS[table]
+    assignments = [
+        # 임베딩이 NULL 이면 (텍스트가 그대로라 다시 계산하지 않은 경우) 기존 값을 유지
+        f"{name} = COALESCE(EXCLUDED.{name}, {table}.{name})" if name in EMBEDDING_TEXT_COLUMNS else f"{name} = EXCLUDED.{name}"
+        for name in columns
+    ]
+    names = ", ".join(TABLE_COLUMNS[table])
+    return f"""
+    INSERT INTO {table} ({names})
+    SELECT {names} FROM stage_{table}
+    ON CONFLICT ({key}) DO UPDATE SET {", ".join(assignments)}
+    """
+
+
+async def apply_sync(conn, staged: dict):
+    # 모든 변경을 한 트랜잭션에서 반영한다. 추가/수정은 FK 순서, 삭제는 역순
+    tables = [table for stage in LOAD_STAGES for table in stage]
+    async with conn.transaction():
+        for table in tables:
+            await conn.execute(upsert_from_stage_sql(table))
+            # 아래에서 함께 지워지는 행의 해시도 지워지도록 삭제 전에 기록한다
+            await conn.execute(SAVE_SYNC_HASHES_QUERY, table, staged[table]["changed_ids"], staged[table]["changed_hashes"])
+
+        # 제품/리뷰어를 지우면 ORM cascade 처럼 남은 리뷰도 함께 지운다
+        removed_reviews = await conn.fetch(
+            """
+            DELETE FROM review
+            WHERE review_id = ANY($1::integer[]) OR product_id = ANY($2::integer[]) OR reviewer_id = ANY($3::integer[])
+            RETURNING review_id
+            """,
+            staged["review"]["removed_ids"], staged["product"]["removed_ids"], staged["reviewer"]["removed_ids"],
+        )
+        await conn.execute(DELETE_SYNC_HASHES_QUERY, "review", [row["review_id"] for row in removed_reviews])
+        staged["review"]["removed"] = len(removed_reviews)
+        for table in reversed(tables):
+            if table != "review":
+                key = TABLE_COLUMNS[table][0]
+                await conn.execute(f"DELETE FROM {table} WHERE {key} = ANY($1::integer[])", staged[table]["removed_ids"])
+                await conn.execute(DELETE_SYNC_HASHES_QUERY, table, staged[table]["removed_ids"])
+                staged[table]["removed"] = len(staged[table]["removed_ids"])
+
+
+async def sync(paths: dict, chunk_size: int = CHUNK_SIZE, embedder=None):
+    """CSV 를 지난 동기화 결과와 비교해 바뀐 행만 추가/수정하고 사라진 행은 삭제한다."""
+    start = time.perf_counter()
+    async with engine.connect() as conn:
+        driver = (await conn.get_raw_connection()).driver_connection
+        staged = {}
+        for stage in LOAD_STAGES:
+            for table in stage:
+                staged[table] = await stage_sync_table(driver, table, paths[table], chunk_size, embedder)
+        await apply_sync(driver, staged)
+        for table in staged:
+            await driver.execute(f"DROP TABLE IF EXISTS stage_{table}")
+    for table, result in staged.items():
+        print(
+            f"{table}: {result['rows']} rows, {result['new']} new, "
+            f"{len(result['changed_ids']) - result['new']} changed, {result['removed']} removed, "
+            f"{result['embedded']} embedded"
+        )
+    print(f"sync: {time.perf_counter() - start:.1f}s")
+
+
+async def main(
+    csv_dir: str,
+    chunk_size: int = CHUNK_SIZE,
+    defer_indexes: bool = False,
+    embed: bool = False,
+    embed_workers: int = EMBED_WORKERS,
+    embed_batch_size: int = EMBED_BATCH_SIZE,
+    mode: str = "load",
+):
+    tables = [table for stage in LOAD_STAGES for table in stage]
+    paths = {table: os.path.join(csv_dir, f"{table}.csv") for table in tables}
+    embedder = ChunkEmbedder(embed_workers, embed_batch_size) if embed else None
+    if mode == "sync":
+        async with engine.begin() as conn:
+            await conn.run_sync(lambda sync_conn: models.SyncRowHash.__table__.create(sync_conn, checkfirst=True))
+        try:
+            await sync(paths, chunk_size, embedder)
+        finally:
+            if embedder is not None:
+                embedder.shutdown()
+        await reset_sequences(tables)
+        await engine.dispose()
+        return
+
+    if embed:
+        async with engine.begin() as conn:
+            await conn.run_sync(lambda sync_conn: models.UploadCheckpoint.__table__.create(sync_conn, checkfirst=True))
+    index_definitions = await defer_indexes_and_triggers(tables) if defer_indexes else []
+
+    # 트리거를 끈 경우 제품별 리뷰 수 증가분을 직접 반영하기 위해 센다
+    review_counts = pd.Series(dtype="int64")
+
+    def count_reviews(chunk):
+        nonlocal review_counts
+        counts = pd.to_numeric(chunk["product_id"]).value_counts()
+        review_counts = review_counts.add(counts, fill_value=0)
+
+    start = time.perf_counter()
+    try:
+        for stage in LOAD_STAGES:
+            await asyncio.gather(*(
+                load_table(
+                    table,
+                    paths[table],
+                    chunk_size,
+                    count_reviews if defer_indexes and table == "review" else None,
+                    embedder,
+                )
+                for table in stage
+            ))
+    finally:
+        if embedder is not None:
+            embedder.shutdown()
+        if defer_indexes:
+            await restore_indexes_and_triggers(tables, index_definitions, review_counts.to_dict())
+    await reset_sequences(tables)
+    if embed:
+        # 모두 적재했으면 진행 위치를 지운다 (같은 경로의 새 파일은 처음부터 적재)
+        async with engine.begin() as conn:
+            for table in tables:
+                await conn.execute(
+                    text("DELETE FROM upload_checkpoint WHERE table_name = :table AND csv_path = :csv_path"),
+                    {"table": table, "csv_path": os.path.abspath(paths[table])},
+                )
+    print(f"total: {time.perf_counter() - start:.1f}s")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--csv-dir", default="./csv")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument(
+        "--defer-indexes", action="store_true",
+        help="적재 전에 보조 인덱스와 트리거를 끄고, 적재 후 다시 만들고 파생 테이블을 재계산",
+    )
+    parser.add_argument(
+        "--embed", action="store_true",
+        help="CSV 의 임베딩 컬럼 대신 product_name/review_content 로 직접 계산 (청크마다 커밋, 중단 시 이어서 적재)",
+    )
+    parser.add_argument("--embed-workers", type=int, default=EMBED_WORKERS)
+    parser.add_argument("--embed-batch-size", type=int, default=EMBED_BATCH_SIZE)
+    parser.add_argument(
+        "--mode", choices=["load", "sync"], default="load",
+        help="load: 전체 적재, sync: 지난 동기화 이후 바뀐 행만 추가/수정하고 사라진 행은 삭제",
+    )
+    args = parser.parse_args()
+    if args.mode == "sync" and args.defer_indexes:
+        parser.error("--defer-indexes 는 load 모드에서만 사용할 수 있습니다")
+    asyncio.run(main(
+        args.csv_dir, args.chunk_size, args.defer_indexes, args.embed, args.embed_workers, args.embed_batch_size, args.mode
+    ))